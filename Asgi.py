@@ -0,0 +1,11 @@
+from a2wsgi import WSGIMiddleware
+from Server import app as flask_app
+import os
+
+
+# Run with e.g. "uvicorn Asgi:app --workers 2". The event loop holds the open
+# connections while requests run in a bounded thread pool, so a request
+# waiting on bcrypt or a database lock only occupies one thread. Keep
+# ASGI_THREADS at or below DATABASE_MAX_CONNECTIONS, or the connection pool
+# runs out before the thread pool does.
+app = WSGIMiddleware(flask_app, workers = int(os.environ.get("ASGI_THREADS", 16)))
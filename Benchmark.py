@@ -0,0 +1,763 @@
+import argparse, json, math, os, random, signal, subprocess, sys, tempfile, threading, \
+	time, uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+WORDS = ("buy", "milk", "call", "report", "meeting", "doctor", "book", "pay",
+	"rent", "email", "review", "code", "plan", "trip", "gift", "clean")
+PASSWORD = "password"
+
+
+def percentile(values, p):
+	if not values:
+		return None
+	values = sorted(values)
+	return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Scenario:
+	"""Seeds a synthetic database and builds request arguments for every
+	route. Argument builders consume seeded rows where a route destroys them,
+	so each run needs a freshly seeded database."""
+
+	def __init__(self, users, folders, tasks, requests, seed):
+		self.users = users
+		self.folders = folders
+		self.tasks = tasks
+		self.requests = requests
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+
+	def seed_database(self):
+		import bcrypt
+		from peewee import chunked
+		from Database import db, User, Folder, Task, task_fields, write_transaction, \
+			use_shard, assign_shard
+		from Hashing import ROUNDS
+		from Server import create_token
+
+		password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(ROUNDS))
+		# Spare folders and tasks are what delete_folder and remove_task use up.
+		spare_folders = math.ceil(self.requests / self.users)
+		self.accounts = []
+		for number in range(self.users):
+			username = f"bench{number}"
+			with use_shard(assign_shard(username)), db.obj.connection_context():
+				with write_transaction():
+					user = User.create(username = username, password = password)
+					Folder.insert_many([{"user_id": user.user_id,
+						"folder_name": f"Folder {i}"} for i in range(self.folders)]).execute()
+					Folder.insert_many([{"user_id": user.user_id,
+						"folder_name": f"Spare {i}"} for i in range(spare_folders)]).execute()
+					folder_ids = [el.folder_id for el in Folder.select(Folder.folder_id)
+						.where(Folder.user_id == user.user_id).order_by(Folder.folder_id)]
+					rows = [{"folder_id": folder_id, **task_fields(
+						" ".join(self.random.sample(WORDS, 4)),
+						f"2030-{self.random.randint(1, 12):02d}-{self.random.randint(1, 28):02d}",
+						self.random.randint(1, 5))}
+						for folder_id in folder_ids[:self.folders] for _ in range(self.tasks)]
+					for chunk in chunked(rows, 100):
+						Task.insert_many(chunk).execute()
+				task_ids = [el.task_id for el in Task.select(Task.task_id).join(Folder)
+					.where(Folder.user_id == user.user_id)]
+				self.random.shuffle(task_ids)
+				self.accounts.append({
+					"username": user.username,
+					"token": create_token(user.username, 24 * 60)["token"],
+					"tasks": task_ids,
+					"spare_folders": folder_ids[self.folders:]
+				})
+
+	def account(self, needs = None):
+		# Prefers accounts that still have rows of the kind a route uses up.
+		accounts = [el for el in self.accounts if el[needs]] if needs else None
+		return self.random.choice(accounts or self.accounts)
+
+	def folder_number(self):
+		return self.random.randrange(self.folders)
+
+	def arguments(self, route):
+		with self.lock:
+			return getattr(self, "args_" + route)()
+
+	def args_registration(self):
+		return {"username": f"new-{uuid.uuid4().hex}", "password": PASSWORD}
+
+	def args_login(self):
+		return {"username": self.account()["username"], "password": PASSWORD}
+
+	def args_update_token(self):
+		return {"token": self.account()["token"]}
+
+	def args_get_folders(self):
+		return {"token": self.account()["token"]}
+
+	def args_overview(self):
+		return {"token": self.account()["token"]}
+
+	def args_create_folder(self):
+		return {"token": self.account()["token"], "folder_name": uuid.uuid4().hex}
+
+	def args_rename_folder(self):
+		return {"token": self.account()["token"], "folder_number": self.folder_number(),
+			"new_name": uuid.uuid4().hex}
+
+	def args_get_tasks(self):
+		return {"token": self.account()["token"], "folder_number": self.folder_number()}
+
+	def args_upcoming_tasks(self):
+		return {"token": self.account()["token"], "deadline_from": "2030-01-01"}
+
+	def args_search_tasks(self):
+		return {"token": self.account()["token"], "query": self.random.choice(WORDS)}
+
+	def args_new_task(self):
+		return {"token": self.account()["token"], "folder_number": self.folder_number(),
+			"task_content": " ".join(self.random.sample(WORDS, 4)),
+			"task_deadline": "2030-06-01", "task_priority": "3"}
+
+	def args_batch_tasks(self):
+		folder_number = self.folder_number()
+		return {"token": self.account()["token"], "operations": json.dumps([
+			{"op": "new", "folder_number": folder_number, "task_content": word,
+				"task_deadline": "2030-06-01", "task_priority": "2"}
+			for word in self.random.sample(WORDS, 10)])}
+
+	def args_update_task(self):
+		account = self.account()
+		return {"token": account["token"],
+			"task_id": self.random.choice(account["tasks"]) if account["tasks"] else 0,
+			"new_folder_number": self.folder_number(), "new_content": "updated",
+			"new_deadline": "2030-07-01", "new_priority": "4"}
+
+	def args_remove_task(self):
+		account = self.account("tasks")
+		return {"token": account["token"],
+			"task_id": account["tasks"].pop() if account["tasks"] else 0}
+
+	def args_sync(self):
+		return {"token": self.account()["token"], "since": 0}
+
+	def args_delete_folder(self):
+		account = self.account("spare_folders")
+		return {"token": account["token"], "folder_id":
+			account["spare_folders"].pop() if account["spare_folders"] else 0}
+
+
+# Run in this order: the destructive routes come last.
+ROUTES = ("registration", "login", "update_token", "get_folders", "overview", "create_folder",
+	"rename_folder", "get_tasks", "upcoming_tasks", "search_tasks", "new_task",
+	"batch_tasks", "update_task", "remove_task", "sync", "delete_folder")
+
+
+class QueryCounter:
+	"""Counts SQL statements per thread through Database.query_listeners."""
+
+	def __init__(self, query_listeners):
+		self.local = threading.local()
+		query_listeners.append(self.record)
+
+	def record(self, sql, seconds):
+		self.local.count = getattr(self.local, "count", 0) + 1
+
+	def reset(self):
+		self.local.count = 0
+
+	def count(self):
+		return getattr(self.local, "count", 0)
+
+
+def client_sender(counter):
+	from Server import app
+	local = threading.local()
+
+	def send(route, args):
+		if not hasattr(local, "client"):
+			local.client = app.test_client()
+		counter.reset()
+		status = local.client.post("/" + route, data = args).status_code
+		return status, counter.count()
+	return send
+
+
+def http_sender(address):
+	import requests
+	local = threading.local()
+
+	def send(route, args):
+		if not hasattr(local, "session"):
+			local.session = requests.Session()
+		return local.session.post(address + route, args).status_code, None
+	return send
+
+
+class LoginStorm:
+	"""Keeps threads logging in until stopped, so that other routes can be
+	timed while bcrypt saturates the hashing pool."""
+
+	def __init__(self, scenario, send, threads):
+		self.scenario = scenario
+		self.send = send
+		self.threads = threads
+		self.latencies = []
+		self.statuses = Counter()
+		self._stop = threading.Event()
+		self._lock = threading.Lock()
+		self._workers = []
+
+	def _login(self):
+		while not self._stop.is_set():
+			args = self.scenario.arguments("login")
+			start = time.perf_counter()
+			status, _ = self.send("login", args)
+			with self._lock:
+				self.latencies.append((time.perf_counter() - start) * 1000)
+				self.statuses[status] += 1
+
+	def start(self):
+		for _ in range(self.threads):
+			worker = threading.Thread(target = self._login, daemon = True)
+			worker.start()
+			self._workers.append(worker)
+
+	def stop(self):
+		self._stop.set()
+		for worker in self._workers:
+			worker.join()
+		return {
+			"threads": self.threads,
+			"requests": len(self.latencies),
+			"statuses": {str(key): value for key, value in sorted(self.statuses.items())},
+			"p50_ms": round(percentile(self.latencies, 50) or 0, 3),
+			"p99_ms": round(percentile(self.latencies, 99) or 0, 3)
+		}
+
+
+def measure(scenario, send, route, count, concurrency):
+	arguments = [scenario.arguments(route) for _ in range(count)]
+
+	def timed(args):
+		start = time.perf_counter()
+		status, queries = send(route, args)
+		return time.perf_counter() - start, status, queries
+
+	start = time.perf_counter()
+	with ThreadPoolExecutor(concurrency) as executor:
+		results = list(executor.map(timed, arguments))
+	elapsed = time.perf_counter() - start
+
+	latencies = [el[0] * 1000 for el in results]
+	queries = [el[2] for el in results if el[2] is not None]
+	return {
+		"requests": count,
+		"errors": sum(1 for el in results if el[1] >= 400),
+		"statuses": {str(key): value for key, value in
+			sorted(Counter(el[1] for el in results).items())},
+		"throughput": round(count / elapsed, 2),
+		"p50_ms": round(percentile(latencies, 50), 3),
+		"p95_ms": round(percentile(latencies, 95), 3),
+		"p99_ms": round(percentile(latencies, 99), 3),
+		"queries_per_request": round(sum(queries) / len(queries), 2) if queries else None
+	}
+
+
+def wait_for_server(process, name, port):
+	import requests
+	for _ in range(100):
+		if process.poll() is not None:
+			raise RuntimeError("%s exited with code %d" % (name, process.returncode))
+		try:
+			requests.get(f"http://127.0.0.1:{port}/swagger.json", timeout = 1)
+			return process
+		except requests.exceptions.RequestException:
+			time.sleep(0.1)
+	os.killpg(process.pid, signal.SIGKILL)
+	raise RuntimeError(f"{name} did not start")
+
+
+def start_gunicorn(directory, workers, port):
+	process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-w", str(workers),
+		"-b", f"127.0.0.1:{port}", "--pythonpath", os.path.dirname(os.path.abspath(__file__)),
+		"Server:app"], cwd = directory, env = os.environ.copy(), start_new_session = True)
+	return wait_for_server(process, "gunicorn", port)
+
+
+def start_uvicorn(directory, workers, port):
+	process = subprocess.Popen([sys.executable, "-m", "uvicorn", "--workers", str(workers),
+		"--host", "127.0.0.1", "--port", str(port), "--no-access-log",
+		"--app-dir", os.path.dirname(os.path.abspath(__file__)), "Asgi:app"],
+		cwd = directory, env = os.environ.copy(), start_new_session = True)
+	return wait_for_server(process, "uvicorn", port)
+
+
+SERVERS = {"gunicorn": start_gunicorn, "uvicorn": start_uvicorn}
+
+
+def prepare(options, **settings):
+	"""Points the service at fresh databases in a scratch directory and seeds
+	them. Database.py and Hashing.py read their settings at import time, so
+	this has to run before they are imported."""
+	directory = tempfile.mkdtemp(prefix = "todolist-bench-")
+	os.chdir(directory)
+	os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+	os.environ["SHARD_URLS"] = ",".join(f"sqlite:///{os.path.join(directory, f'bench{i}.db')}"
+		for i in range(options.shards)) if options.shards > 1 else os.environ["DATABASE_URL"]
+	os.environ["BCRYPT_ROUNDS"] = str(options.bcrypt_rounds)
+	if not options.rate_limits:
+		os.environ["RATE_LIMITS_USER"] = os.environ["RATE_LIMITS_IP"] = ""
+	os.environ.update(settings)
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+	scenario = Scenario(options.users, options.folders, options.tasks,
+		options.requests, options.seed)
+	start = time.perf_counter()
+	scenario.seed_database()
+	return directory, scenario, time.perf_counter() - start
+
+
+def seed_config(options, seed_seconds):
+	return {
+		"users": options.users,
+		"folders": options.folders,
+		"tasks": options.tasks,
+		"requests": options.requests,
+		"concurrency": options.concurrency,
+		"shards": options.shards,
+		"seed_seconds": round(seed_seconds, 2)
+	}
+
+
+def start_server(options, directory):
+	"""Returns the server process, if any, and the function sending requests."""
+	if options.mode in SERVERS:
+		process = SERVERS[options.mode](directory, options.workers, options.port)
+		return process, http_sender(f"http://127.0.0.1:{options.port}/")
+	from Database import query_listeners
+	return None, client_sender(QueryCounter(query_listeners))
+
+
+def stop_server(process):
+	if process:
+		# The whole session, with the hashing pools of the workers
+		os.killpg(process.pid, signal.SIGTERM)
+		process.wait()
+
+
+def run(options):
+	directory, scenario, seed_seconds = prepare(options)
+	process, send = start_server(options, directory)
+	try:
+		routes = {route: measure(scenario, send, route, options.requests,
+			options.concurrency) for route in options.routes}
+	finally:
+		stop_server(process)
+
+	return {
+		"config": {
+			"mode": options.mode,
+			"workers": options.workers if options.mode in SERVERS else None,
+			**seed_config(options, seed_seconds)
+		},
+		"routes": routes
+	}
+
+
+# Routes whose queries the indexes of Folders and Tasks serve
+INDEX_ROUTES = ("get_folders", "create_folder", "overview", "get_tasks", "upcoming_tasks")
+
+
+def time_indexes(options):
+	"""Times the routes in INDEX_ROUTES on the same database twice: with the
+	secondary indexes of Folders and Tasks dropped, then created again. The
+	listing cache is off, so every request runs its queries."""
+	_, scenario, seed_seconds = prepare(options, LISTING_CACHE_SIZE = "0")
+	from Database import shards, query_listeners
+	send = client_sender(QueryCounter(query_listeners))
+	indexes = []
+	for database in shards:
+		with database.connection_context():
+			rows = database.execute_sql("SELECT name, sql FROM sqlite_master "
+				"WHERE type = 'index' AND tbl_name IN ('Folders', 'Tasks') "
+				"AND sql IS NOT NULL").fetchall()
+			for name, _ in rows:
+				database.execute_sql(f'DROP INDEX "{name}"')
+			indexes.append(rows)
+	before = {route: measure(scenario, send, route, options.requests,
+		options.concurrency) for route in options.routes}
+	for database, rows in zip(shards, indexes):
+		with database.connection_context():
+			for _, sql in rows:
+				database.execute_sql(sql)
+			database.execute_sql("ANALYZE")
+	after = {route: measure(scenario, send, route, options.requests,
+		options.concurrency) for route in options.routes}
+	return {
+		"config": {
+			"indexes": sorted({name for rows in indexes for name, _ in rows}),
+			**seed_config(options, seed_seconds)
+		},
+		"before": before,
+		"after": after
+	}
+
+
+def fill_folder(account, size, random):
+	"""Creates a folder of size tasks for account and returns its id."""
+	from peewee import chunked
+	from Database import db, User, Folder, Task, task_fields, write_transaction, \
+		use_shard, locate_user
+	with use_shard(locate_user(account["username"])), db.obj.connection_context():
+		with write_transaction():
+			user = User.get(User.username == account["username"])
+			folder = Folder.create(user_id = user.user_id, folder_name = uuid.uuid4().hex)
+			rows = ({"folder_id": folder.folder_id, **task_fields(
+				" ".join(random.sample(WORDS, 4)), "2030-06-01", 3)} for _ in range(size))
+			for chunk in chunked(rows, 500):
+				Task.insert_many(chunk).execute()
+	return folder.folder_id
+
+
+def delete_per_task(account, folder_id):
+	"""The deletion this repo started with: one DELETE and one commit per task."""
+	from Database import db, Folder, Task, use_shard, locate_user
+	with use_shard(locate_user(account["username"])), db.obj.connection_context():
+		for task in Task.select().where(Task.folder_id == folder_id):
+			task.delete_instance()
+		Folder.delete_by_id(folder_id)
+
+
+def time_folder_delete(options):
+	"""Times /delete_folder on folders of options.sizes tasks, and the old
+	task-by-task deletion on the sizes up to options.per_task_limit."""
+	_, scenario, seed_seconds = prepare(options)
+	from Database import query_listeners
+	send = client_sender(QueryCounter(query_listeners))
+	account = scenario.accounts[0]
+	sizes = {}
+	for size in options.sizes:
+		latencies, queries, errors = [], [], 0
+		for _ in range(options.repeat):
+			folder_id = fill_folder(account, size, scenario.random)
+			start = time.perf_counter()
+			status, count = send("delete_folder",
+				{"token": account["token"], "folder_id": folder_id})
+			latencies.append((time.perf_counter() - start) * 1000)
+			queries.append(count)
+			errors += status != 200
+		result = {
+			"errors": errors,
+			"p50_ms": round(percentile(latencies, 50), 3),
+			"max_ms": round(max(latencies), 3),
+			"queries_per_request": max(queries)
+		}
+		if size <= options.per_task_limit:
+			latencies = []
+			for _ in range(options.repeat):
+				folder_id = fill_folder(account, size, scenario.random)
+				start = time.perf_counter()
+				delete_per_task(account, folder_id)
+				latencies.append((time.perf_counter() - start) * 1000)
+			result["per_task_p50_ms"] = round(percentile(latencies, 50), 3)
+		sizes[str(size)] = result
+	return {
+		"config": {"repeat": options.repeat, **seed_config(options, seed_seconds)},
+		"sizes": sizes
+	}
+
+
+def seeding_arguments(options):
+	"""The command line options that seed the same database as options."""
+	arguments = ["--users", options.users, "--folders", options.folders,
+		"--tasks", options.tasks, "--requests", options.requests,
+		"--concurrency", options.concurrency, "--shards", options.shards,
+		"--bcrypt-rounds", options.bcrypt_rounds, "--seed", options.seed]
+	if options.rate_limits:
+		arguments.append("--rate-limits")
+	return [str(el) for el in arguments]
+
+
+# Write routes that take SQLite's write lock, with a read route for reference
+CONTENTION_ROUTES = ("get_tasks", "new_task", "batch_tasks", "update_task", "rename_folder")
+
+
+def time_contention(options):
+	"""Runs the routes once per SQLite pragma profile and
+	reports the share of requests refused with 503 because the database was
+	locked. Each profile runs in a process of its own, as Database.py reads
+	it at import."""
+	profiles = {}
+	for profile in options.profiles:
+		with tempfile.TemporaryDirectory() as directory:
+			output = os.path.join(directory, "report.json")
+			subprocess.run([sys.executable, os.path.abspath(__file__), "run",
+				"--mode", options.mode, "--workers", str(options.workers),
+				"--port", str(options.port), "--routes", *options.routes,
+				"--output", output, *seeding_arguments(options)],
+				env = {**os.environ, "DATABASE_PROFILE": profile}, check = True)
+			with open(output) as file:
+				routes = json.load(file)["routes"]
+		requests = sum(el["requests"] for el in routes.values())
+		locked = sum(el["statuses"].get("503", 0) for el in routes.values())
+		profiles[profile] = {
+			"locked_rate": round(locked / requests, 4),
+			"routes": routes
+		}
+	return {
+		"config": {
+			"mode": options.mode,
+			"workers": options.workers if options.mode in SERVERS else None,
+			"concurrency": options.concurrency,
+			"busy_timeout_ms": os.environ.get("DATABASE_BUSY_TIMEOUT_MS", "5000")
+		},
+		"profiles": profiles
+	}
+
+
+def time_scale(options):
+	"""Runs the routes over options.mode with each of options.workers worker
+	counts, each in a process of its own, and tabulates their throughput."""
+	reports = {}
+	for workers in options.workers:
+		with tempfile.TemporaryDirectory() as directory:
+			output = os.path.join(directory, "report.json")
+			subprocess.run([sys.executable, os.path.abspath(__file__), "run",
+				"--mode", options.mode, "--workers", str(workers),
+				"--port", str(options.port), "--routes", *options.routes,
+				"--output", output, *seeding_arguments(options)], check = True)
+			with open(output) as file:
+				reports[str(workers)] = json.load(file)
+	return {
+		"config": {**next(iter(reports.values()))["config"], "workers": options.workers},
+		"routes": {route: {workers: {key: report["routes"][route][key]
+			for key in ("throughput", "p50_ms", "p99_ms", "errors")}
+			for workers, report in reports.items()} for route in options.routes}
+	}
+
+
+def time_search(options):
+	"""Times search_tasks through the full-text index, then with the LIKE
+	scan it falls back to when SQLite lacks FTS5. Common words match a
+	quarter of the tasks; a missing word makes LIKE read all of them."""
+	_, scenario, seed_seconds = prepare(options)
+	import Server
+	from Database import query_listeners
+	send = client_sender(QueryCounter(query_listeners))
+	if not Server.SEARCH_ENABLED:
+		raise RuntimeError("SQLite was built without FTS5")
+	results = {"fts": {}, "like": {}}
+	for enabled, method in ((True, "fts"), (False, "like")):
+		Server.SEARCH_ENABLED = enabled
+		for words, kind in ((WORDS, "common_word"), (("missing",), "missing_word")):
+			scenario.args_search_tasks = lambda words = words: {
+				"token": scenario.account()["token"], "query": scenario.random.choice(words)}
+			results[method][kind] = measure(scenario, send, "search_tasks",
+				options.requests, options.concurrency)
+	return {"config": seed_config(options, seed_seconds), **results}
+
+
+def time_login_storm(options):
+	"""Times get_tasks alone, then again while options.logins threads keep
+	logging in. With bcrypt in the hashing pool, its p99 should stay flat."""
+	directory, scenario, seed_seconds = prepare(options)
+	process, send = start_server(options, directory)
+	try:
+		alone = measure(scenario, send, "get_tasks", options.requests, options.concurrency)
+		storm = LoginStorm(scenario, send, options.logins)
+		storm.start()
+		try:
+			during = measure(scenario, send, "get_tasks", options.requests,
+				options.concurrency)
+		finally:
+			logins = storm.stop()
+	finally:
+		stop_server(process)
+	return {
+		"config": {
+			"mode": options.mode,
+			"workers": options.workers if options.mode in SERVERS else None,
+			"bcrypt_rounds": options.bcrypt_rounds,
+			**seed_config(options, seed_seconds)
+		},
+		"get_tasks": {"alone": alone, "during_logins": during},
+		"logins": logins
+	}
+
+
+def time_limiter(options):
+	"""Average cost of one RateLimiter.acquire over options.keys clients."""
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	from RateLimit import RateLimiter
+	limiter = RateLimiter()
+	keys = [f"*:user:{i}" for i in range(options.keys)]
+	start = time.perf_counter()
+	for i in range(options.calls):
+		limiter.acquire(keys[i % options.keys], 20, 40)
+	elapsed = time.perf_counter() - start
+	return {"calls": options.calls, "keys": options.keys,
+		"us_per_call": round(elapsed / options.calls * 1e6, 3)}
+
+
+def compare(baseline, current, threshold):
+	"""Returns the regressions of current against baseline, where latency and
+	queries may grow and throughput may drop by at most threshold."""
+	regressions = []
+	for key in ("mode", "users", "folders", "tasks", "concurrency", "workers"):
+		if baseline["config"].get(key) != current["config"].get(key):
+			print(f"WARNING {key} differs: {baseline['config'].get(key)} "
+				f"!= {current['config'].get(key)}", file = sys.stderr)
+	for route, base in baseline["routes"].items():
+		result = current["routes"].get(route)
+		if not result:
+			continue
+		for metric in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+			if base[metric] is not None and result[metric] is not None and \
+					result[metric] > base[metric] * (1 + threshold):
+				regressions.append(f"{route}: {metric} {base[metric]} -> {result[metric]}")
+		if result["throughput"] < base["throughput"] * (1 - threshold):
+			regressions.append(
+				f"{route}: throughput {base['throughput']} -> {result['throughput']}")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description = "ToDoList endpoint benchmarks")
+	commands = parser.add_subparsers(dest = "command", required = True)
+
+	def seeding():
+		"""Options of every command that seeds a database. A new parser for
+		each command, as the commands share the actions of their parents and
+		set_defaults on one would change the defaults of all."""
+		parser = argparse.ArgumentParser(add_help = False)
+		parser.add_argument("--users", type = int, default = 10)
+		parser.add_argument("--folders", type = int, default = 5, help = "per user")
+		parser.add_argument("--tasks", type = int, default = 100, help = "per folder")
+		parser.add_argument("--requests", type = int, default = 200, help = "per route")
+		parser.add_argument("--concurrency", type = int, default = 1)
+		parser.add_argument("--shards", type = int, default = 1,
+			help = "SQLite databases the users are spread over")
+		parser.add_argument("--bcrypt-rounds", type = int, default = 4)
+		parser.add_argument("--seed", type = int, default = 0)
+		parser.add_argument("--rate-limits", action = "store_true",
+			help = "keep the server's rate limits, which are off by default")
+		return parser
+
+	# Options of every command that sends requests to a server
+	serving = argparse.ArgumentParser(add_help = False)
+	serving.add_argument("--mode", choices = ("client", *SERVERS), default = "client",
+		help = "Flask test client in-process, or a local gunicorn or uvicorn over HTTP")
+	serving.add_argument("--workers", type = int, default = 4,
+		help = "gunicorn or uvicorn workers")
+	serving.add_argument("--port", type = int, default = 8765)
+
+	run_parser = commands.add_parser("run", parents = [seeding(), serving],
+		help = "seed a database and time every route")
+	run_parser.add_argument("--routes", nargs = "+", choices = ROUTES, default = list(ROUTES))
+	run_parser.add_argument("--output", help = "write the JSON report here instead of stdout")
+	run_parser.add_argument("--baseline", help = "report to compare the results against")
+	run_parser.add_argument("--threshold", type = float, default = 0.2)
+
+	indexes_parser = commands.add_parser("indexes", parents = [seeding()],
+		help = "time the listing routes without and with the secondary indexes")
+	indexes_parser.add_argument("--routes", nargs = "+", choices = INDEX_ROUTES,
+		default = list(INDEX_ROUTES))
+	# 1M tasks by default
+	indexes_parser.set_defaults(users = 100, folders = 10, tasks = 1000, requests = 50)
+
+	delete_parser = commands.add_parser("delete-folder", parents = [seeding()],
+		help = "time /delete_folder on folders of growing sizes")
+	delete_parser.add_argument("--sizes", type = int, nargs = "+", default = [10, 1000, 100000],
+		help = "tasks in each deleted folder")
+	delete_parser.add_argument("--repeat", type = int, default = 3,
+		help = "folders deleted per size")
+	delete_parser.add_argument("--per-task-limit", type = int, default = 1000,
+		help = "largest size to also delete task by task, as the service used to")
+	delete_parser.set_defaults(users = 10, folders = 2, tasks = 10, requests = 10)
+
+	contention_parser = commands.add_parser("contention", parents = [seeding(), serving],
+		help = "count the requests refused on a locked database per pragma profile")
+	contention_parser.add_argument("--routes", nargs = "+", choices = ROUTES,
+		default = list(CONTENTION_ROUTES))
+	contention_parser.add_argument("--profiles", nargs = "+", default = ["default", "performance"],
+		help = "values of DATABASE_PROFILE to compare")
+	contention_parser.set_defaults(mode = "gunicorn", concurrency = 16)
+
+	scale_parser = commands.add_parser("scale", parents = [seeding()],
+		help = "compare the throughput of a server with growing worker counts")
+	scale_parser.add_argument("--mode", choices = tuple(SERVERS), default = "gunicorn")
+	scale_parser.add_argument("--workers", type = int, nargs = "+", default = [1, 4, 16])
+	scale_parser.add_argument("--port", type = int, default = 8765)
+	scale_parser.add_argument("--routes", nargs = "+", choices = ROUTES,
+		default = list(ROUTES))
+	scale_parser.set_defaults(concurrency = 16)
+
+	search_parser = commands.add_parser("search", parents = [seeding()],
+		help = "time search_tasks with the full-text index and with LIKE")
+	# 100k tasks by default
+	search_parser.set_defaults(users = 10, folders = 10, tasks = 1000, requests = 100)
+
+	storm_parser = commands.add_parser("login-storm", parents = [seeding(), serving],
+		help = "time get_tasks alone and during a burst of logins")
+	storm_parser.add_argument("--logins", type = int, default = 16,
+		help = "threads logging in at the same time")
+	storm_parser.set_defaults(bcrypt_rounds = 12, concurrency = 4)
+
+	limiter_parser = commands.add_parser("limiter",
+		help = "time the in-process rate limiter")
+	limiter_parser.add_argument("--calls", type = int, default = 1000000)
+	limiter_parser.add_argument("--keys", type = int, default = 1000)
+
+	compare_parser = commands.add_parser("compare", help = "compare two JSON reports")
+	compare_parser.add_argument("baseline")
+	compare_parser.add_argument("current")
+	compare_parser.add_argument("--threshold", type = float, default = 0.2)
+
+	options = parser.parse_args()
+	if options.command == "run":
+		output = os.path.abspath(options.output) if options.output else None
+		baseline = os.path.abspath(options.baseline) if options.baseline else None
+		report = run(options)
+		text = json.dumps(report, indent = 2)
+		if output:
+			with open(output, "w") as file:
+				file.write(text)
+		else:
+			print(text)
+		current = report
+	elif options.command == "limiter":
+		print(json.dumps(time_limiter(options), indent = 2))
+		return
+	elif options.command == "delete-folder":
+		print(json.dumps(time_folder_delete(options), indent = 2))
+		return
+	elif options.command == "contention":
+		print(json.dumps(time_contention(options), indent = 2))
+		return
+	elif options.command == "scale":
+		print(json.dumps(time_scale(options), indent = 2))
+		return
+	elif options.command == "search":
+		print(json.dumps(time_search(options), indent = 2))
+		return
+	elif options.command == "login-storm":
+		print(json.dumps(time_login_storm(options), indent = 2))
+		return
+	elif options.command == "indexes":
+		print(json.dumps(time_indexes(options), indent = 2))
+		return
+	else:
+		baseline = options.baseline
+		with open(options.current) as file:
+			current = json.load(file)
+
+	if baseline:
+		with open(baseline) as file:
+			regressions = compare(json.load(file), current, options.threshold)
+		for line in regressions:
+			print("REGRESSION " + line, file = sys.stderr)
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,175 @@
+import time, threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+def cache_stats(size, hits, misses):
+	return {"size": size, "hits": hits, "misses": misses,
+		"hit_ratio": hits / (hits + misses) if hits + misses else 0.0}
+
+
+class LRUCache:
+	"""Thread-safe LRU cache with optional per-entry expiry."""
+
+	def __init__(self, max_size = 1024, ttl = None):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.hits = 0
+		self.misses = 0
+		self._items = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default = None):
+		with self._lock:
+			item = self._items.get(key)
+			if item is not None and item[1] is not None and item[1] <= time.time():
+				del self._items[key]
+				item = None
+			if item is None:
+				self.misses += 1
+				return default
+			self._items.move_to_end(key)
+			self.hits += 1
+			return item[0]
+
+	def set(self, key, value, expire = None):
+		if self.ttl is not None:
+			ttl_expire = time.time() + self.ttl
+			expire = ttl_expire if expire is None else min(expire, ttl_expire)
+		with self._lock:
+			self._items[key] = (value, expire)
+			self._items.move_to_end(key)
+			while len(self._items) > self.max_size:
+				self._items.popitem(last = False)
+
+	def delete(self, key):
+		with self._lock:
+			self._items.pop(key, None)
+
+	def delete_where(self, predicate):
+		with self._lock:
+			for key in [key for key in self._items if predicate(key)]:
+				del self._items[key]
+
+	def clear(self):
+		with self._lock:
+			self._items.clear()
+
+	def stats(self):
+		return cache_stats(len(self._items), self.hits, self.misses)
+
+
+class SharedCache:
+	"""Cache of string values kept in a server shared by all workers.
+	Subclasses implement _get, _set, _delete and _clear; errors of the
+	server count as misses so that requests fall back to the database."""
+
+	errors = (OSError,)
+
+	def __init__(self, ttl = None, prefix = "todolist:"):
+		self.ttl = ttl
+		self.prefix = prefix
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+	def _count(self, hit):
+		with self._lock:
+			if hit:
+				self.hits += 1
+			else:
+				self.misses += 1
+
+	def get(self, key, default = None):
+		try:
+			value = self._get(self.prefix + key)
+		except self.errors:
+			value = None
+		self._count(value is not None)
+		return default if value is None else value.decode()
+
+	def set(self, key, value, expire = None):
+		ttl = self.ttl
+		if expire is not None:
+			ttl = min(ttl or float("inf"), expire - time.time())
+		if ttl is not None and ttl <= 0:
+			return
+		try:
+			self._set(self.prefix + key, value.encode(),
+				None if ttl is None else max(int(ttl), 1))
+		except self.errors:
+			pass
+
+	def delete(self, key):
+		try:
+			self._delete(self.prefix + key)
+		except self.errors:
+			pass
+
+	def clear(self):
+		try:
+			self._clear()
+		except self.errors:
+			pass
+
+	def stats(self):
+		# The size of the shared store is not known to a single worker
+		return cache_stats(None, self.hits, self.misses)
+
+
+class RedisCache(SharedCache):
+	def __init__(self, url, ttl = None, prefix = "todolist:"):
+		import redis
+		super().__init__(ttl, prefix)
+		self.errors = (redis.RedisError, OSError)
+		self.client = redis.Redis.from_url(url, socket_timeout = 1)
+
+	def _get(self, key):
+		return self.client.get(key)
+
+	def _set(self, key, value, ttl):
+		self.client.set(key, value, ex = ttl)
+
+	def _delete(self, key):
+		self.client.delete(key)
+
+	def _clear(self):
+		for key in self.client.scan_iter(self.prefix + "*"):
+			self.client.delete(key)
+
+
+class MemcachedCache(SharedCache):
+	def __init__(self, url, ttl = None, prefix = "todolist:"):
+		from pymemcache.client.base import PooledClient
+		from pymemcache.exceptions import MemcacheError
+		super().__init__(ttl, prefix)
+		self.errors = (MemcacheError, OSError)
+		url = urlparse(url)
+		self.client = PooledClient((url.hostname, url.port or 11211),
+			connect_timeout = 1, timeout = 1)
+
+	def _get(self, key):
+		return self.client.get(key)
+
+	def _set(self, key, value, ttl):
+		self.client.set(key, value, expire = ttl or 0)
+
+	def _delete(self, key):
+		self.client.delete(key)
+
+	def _clear(self):
+		# memcached cannot list keys, so clearing drops everything
+		self.client.flush_all()
+
+
+def open_cache(url, max_size = 1024, ttl = None):
+	"""memory:// (or an empty URL) for an LRUCache of this process,
+	redis://host:port/db or memcached://host:port for a shared cache."""
+	scheme = urlparse(url).scheme if url else "memory"
+	if scheme == "memory":
+		return LRUCache(max_size, ttl)
+	if scheme in ("redis", "rediss", "unix"):
+		return RedisCache(url, ttl)
+	if scheme == "memcached":
+		return MemcachedCache(url, ttl)
+	raise ValueError(f"Unsupported cache URL: {url}")
@@ -1,4 +1,7 @@
-import requests, re, datetime, prettytable as pt
+import requests, re, datetime, json, shlex, sys, os, time, argparse, prettytable as pt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 
 
@@ -8,7 +11,7 @@ def check_server_address(address):
 def check_cmd(string):
 	string = string.strip()
 	
-	if re.match("^(\?|login|reg|exit|folders|f|new)$", string):
+	if re.match("^(\?|login|reg|exit|folders|f|new|watch)$", string):
 		return [string]
 	
 	m = re.match("^create( )+(?P<folder_name>[A-Za-z0-9]+)$", string) 
@@ -35,19 +38,75 @@ def check_cmd(string):
 	if m:
 		return ["update", m.group("folder_number"), m.group("task_number")]
 	
+	m = re.match("^import( )+(?P<folder_number>[0-9]+)( )+(?P<path>.+)$", string) 
+	if m:
+		return ["import", m.group("folder_number"), m.group("path")]
+	
 	return [""]
 
 
-def post(route, args = None):
+def open_session(pool_size = 10):
+	"""Keep-alive session that retries failed connections and requests
+	refused with 429 or 503 (rate limited or busy server, nothing was
+	changed) with backoff. Other POSTs are never retried since they may
+	have been applied."""
+	retry = Retry(total = 10, connect = 5, read = 0, status = 10,
+		backoff_factor = 0.5, status_forcelist = (429, 503),
+		allowed_methods = None, raise_on_status = False)
+	adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size,
+		max_retries = retry)
+	session = requests.Session()
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	session.verify = False
+	# requests already sends Accept-Encoding: gzip, deflate
+	return session
+
+
+session = open_session()
+
+
+def post(route, args = None, headers = None):
 	try:
-		return requests.post(addr + route, args, verify = False)
+		return session.post(addr + route, args, headers = headers)
 	except requests.exceptions.ConnectionError:
 		exit("Server is disconnected")
 
 
-def login():
-	username = input("Username: ")
-	password = getpass()
+# Listings by request arguments (without the token): (ETag, answer)
+listing_cache = {}
+COLUMNAR_MEDIATYPE = "application/vnd.todolist.columnar+json"
+
+def rows(data):
+	"""Turns the columnar form ({"columns": [...], "values": [...]}, one
+	array per field) back into lists of objects."""
+	if isinstance(data, dict) and data.keys() == {"columns", "values"}:
+		values = [rows(column) for column in data["values"]]
+		return [dict(zip(data["columns"], row)) for row in zip(*values)]
+	if isinstance(data, dict):
+		return {key: rows(value) for key, value in data.items()}
+	if isinstance(data, list):
+		return [rows(el) for el in data]
+	return data
+
+def cached_post(route, args):
+	key = (route, tuple(sorted((k, str(v)) for k, v in args.items() if k != "token")))
+	cached = listing_cache.get(key)
+	headers = {"Accept": f"{COLUMNAR_MEDIATYPE}, application/json;q=0.5"}
+	if cached:
+		headers["If-None-Match"] = cached[0]
+	response = post(route, args, headers)
+	if response.status_code == 304:
+		return 200, cached[1]
+	answer = rows(response.json())
+	if response.status_code == 200 and "ETag" in response.headers:
+		listing_cache[key] = (response.headers["ETag"], answer)
+	return response.status_code, answer
+
+
+def login(username = None, password = None):
+	username = username or input("Username: ")
+	password = password or getpass()
 	response = post("login", {"username": username, "password": password})
 	answer = response.json()
 	if response.status_code == 200:
@@ -89,6 +148,215 @@ def update_jwt():
 		print(answer["message"])
 	
 
+def format_folders(folders):
+	if len(folders) == 0:
+		return "No folders"
+	table = pt.PrettyTable()
+	table.field_names = ["№", "FOLDER NAME", "TASKS"]
+	for i in range(len(folders)):
+		table.add_row([i, folders[i]["folder_name"], folders[i]["task_count"]])
+	table.align = "l"
+	return table.get_string()
+
+
+def format_tasks(tasks, first_number = 0):
+	if len(tasks) == 0:
+		return "No tasks"
+	table = pt.PrettyTable(hrules = pt.ALL)
+	table.field_names = ["№", "TASK"]
+	for number, task in enumerate(tasks, first_number):
+		nested_table = pt.PrettyTable(header = False, hrules = pt.ALL)
+		nested_table.add_rows([
+			["Content", task["task_content"]],
+			["Deadline", task["task_deadline"]],
+			["Priority", task["task_priority"]],
+		])
+		table.add_row([number, nested_table])
+	return table.get_string()
+
+
+def print_tasks(folder_number, page_size = 20):
+	args = {"token": token, "folder_number": folder_number, "limit": page_size}
+	number = 0
+	while True:
+		status_code, answer = cached_post("get_tasks", args)
+		if status_code != 200:
+			print(answer["message"])
+			return
+		
+		tasks = answer["task_list"]
+		if number == 0 and len(tasks) == 0:
+			print("No tasks")
+			return
+		print(format_tasks(tasks, number))
+		number += len(tasks)
+		
+		if not answer.get("next_cursor") or \
+				input("Press Enter for more tasks or 'q' to stop: ").strip() == "q":
+			return
+		args["cursor"] = answer["next_cursor"]
+
+
+def import_tasks(folder_number, path):
+	try:
+		with open(path, encoding = "utf-8") as file:
+			tasks = json.load(file)
+	except (OSError, ValueError) as e:
+		return f"Cannot read the file: {e}"
+	
+	operations = [{
+		"op": "new",
+		"folder_number": folder_number,
+		"task_content": task.get("task_content", ""),
+		"task_deadline": task.get("task_deadline", ""),
+		"task_priority": task.get("task_priority", "")
+		} for task in tasks]
+	response = post("batch_tasks", {
+		"token": token,
+		"operations": json.dumps(operations)
+		})
+	answer = response.json()
+	if response.status_code != 200:
+		return answer["message"]
+	added = sum(1 for el in answer["results"] if el["status"] == 200)
+	return f"{added} of {len(operations)} tasks added"
+
+
+def describe_event(event):
+	match event:
+		case {"type": "folder" | "task", "ids": ids, "deleted": deleted}:
+			return f"{event['type'].capitalize()} {', '.join(map(str, ids))} " \
+				f"{'deleted' if deleted else 'changed'}"
+	return "Reloaded"
+
+
+def watch():
+	"""Prints the folders again whenever the server pushes a change, until
+	Ctrl+C. After the stream breaks it reconnects and reloads, since changes
+	made in between were missed."""
+	print(run_script_command(["folders"]))
+	try:
+		while True:
+			if token_expire - datetime.datetime.utcnow().timestamp() < \
+					datetime.timedelta(minutes = 5).total_seconds():
+				update_jwt()
+			try:
+				# The server sends a comment at least every 15 seconds
+				with session.post(addr + "subscribe", {"token": token},
+						stream = True, timeout = (10, 60)) as response:
+					if response.status_code != 200:
+						print(response.json()["message"])
+						return
+					for line in response.iter_lines(decode_unicode = True):
+						if line.startswith("data:"):
+							event = json.loads(line[5:])
+							print(f"\n[{datetime.datetime.now():%H:%M:%S}] "
+								f"{describe_event(event)}")
+							print(run_script_command(["folders"]))
+			except requests.exceptions.RequestException:
+				time.sleep(1)
+			print(run_script_command(["folders"]))
+	except KeyboardInterrupt:
+		pass
+
+
+# Script command: (route, arguments, number of required arguments,
+# whether it renumbers folders or tasks). Missing optional arguments are "".
+SCRIPT_COMMANDS = {
+	"create": ("create_folder", ["folder_name"], 1, True),
+	"delete": ("delete_folder", ["folder_number"], 1, True),
+	"rename": ("rename_folder", ["folder_number", "new_name"], 2, False),
+	"new": ("new_task", ["folder_number", "task_content", "task_deadline",
+		"task_priority"], 2, False),
+	"rm": ("remove_task", ["folder_number", "task_number"], 2, True),
+	"update": ("update_task", ["folder_number", "task_number", "new_folder_number",
+		"new_content", "new_deadline", "new_priority"], 4, True)
+}
+
+
+def parse_script_line(line):
+	try:
+		words = shlex.split(line)
+	except ValueError:
+		return None
+	match words:
+		case ["folders" | "f"] | ["tasks" | "t", _] | ["import", _, _]:
+			return words
+		case [name, *args] if name in SCRIPT_COMMANDS:
+			_, names, required, _ = SCRIPT_COMMANDS[name]
+			if required <= len(args) <= len(names):
+				return words
+	return None
+
+
+def fetch_tasks(folder_number):
+	args = {"token": token, "folder_number": folder_number, "limit": 100}
+	tasks = []
+	while True:
+		status_code, answer = cached_post("get_tasks", args)
+		if status_code != 200:
+			return answer["message"]
+		tasks.extend(answer["task_list"])
+		if not answer.get("next_cursor"):
+			return format_tasks(tasks)
+		args["cursor"] = answer["next_cursor"]
+
+
+def run_script_command(words):
+	match words:
+		case ["folders" | "f"]:
+			status_code, answer = cached_post("overview", {"token": token, "top": 0})
+			return answer["message"] if status_code != 200 else \
+				format_folders(answer["folders"])
+		case ["tasks" | "t", folder_number]:
+			return fetch_tasks(folder_number)
+		case ["import", folder_number, path]:
+			return import_tasks(folder_number, path)
+	route, names, _, _ = SCRIPT_COMMANDS[words[0]]
+	args = dict.fromkeys(names, "")
+	args.update(zip(names, words[1:]), token = token)
+	return post(route, args).json()["message"]
+
+
+def run_script(lines, jobs):
+	"""Runs the commands over the pooled session, printing their output in
+	order. Consecutive listings run concurrently, as do consecutive changes.
+	A command that renumbers folders or tasks waits for all earlier ones and
+	runs alone."""
+	pending = []
+	pending_reads = False
+	
+	def flush():
+		for line, future in pending:
+			print(f">> {line}\n{future.result()}\n")
+		pending.clear()
+	
+	with ThreadPoolExecutor(jobs) as executor:
+		for line in lines:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			if token_expire - datetime.datetime.utcnow().timestamp() < \
+					datetime.timedelta(minutes = 5).total_seconds():
+				flush()
+				update_jwt()
+			words = parse_script_line(line)
+			if words is None:
+				pending.append((line, executor.submit(str, "Invalid command")))
+				continue
+			reads = words[0] in ("folders", "f", "tasks", "t")
+			if reads != pending_reads:
+				flush()
+				pending_reads = reads
+			if words[0] in SCRIPT_COMMANDS and SCRIPT_COMMANDS[words[0]][3]:
+				flush()
+				pending.append((line, executor.submit(run_script_command, words)))
+				flush()
+			else:
+				pending.append((line, executor.submit(run_script_command, words)))
+		flush()
+
+
 def print_help():		
 	table = pt.PrettyTable()
 	table.field_names = ["COMMAND", "DESCRIPTION"]
@@ -101,6 +369,8 @@ def print_help():
 		["new", "Create a new task in the folder"],
 		["rm <folder number> <task number>", "Remove the task"],
 		["update <folder number> <task number>", "Update the task"],
+		["import <folder number> <file>", "Add tasks from a JSON file to the folder"],
+		["watch", "Show the folders again on every change, until Ctrl+C"],
 		["?", "Show help"],
 		["exit", "Exit the script"]
 	])
@@ -108,8 +378,21 @@ def print_help():
 	print(table)
 	
 if __name__ == "__main__":
-	addr = input("Server: ")
-	if len(addr) == 0:
+	parser = argparse.ArgumentParser(description = "To-Do List Online client")
+	parser.add_argument("--server", help = "server address, asked for when missing")
+	parser.add_argument("--script", help = "run the commands of this file "
+		"(- for stdin) instead of the interactive mode")
+	parser.add_argument("--username", help = "account for --script, the password "
+		"is taken from TODO_PASSWORD or asked for")
+	parser.add_argument("--jobs", type = int, default = 8,
+		help = "commands of a script run at the same time")
+	parser.add_argument("--watch", action = "store_true", help = "show the folders "
+		"of --username again on every change instead of the interactive mode")
+	options = parser.parse_args()
+	
+	addr = options.server if options.server is not None or options.script or \
+		options.watch else input("Server: ")
+	if not addr:
 		addr = "https://to-do-list-project.duckdns.org/" # "http://127.0.0.1:8000/"
 	else:
 		if not check_server_address(addr):
@@ -117,6 +400,27 @@ if __name__ == "__main__":
 	
 	global token, token_expire
 	
+	if options.script:
+		if not options.username:
+			exit("--script needs --username")
+		session = open_session(options.jobs)
+		if not login(options.username, os.environ.get("TODO_PASSWORD")):
+			exit()
+		if options.script == "-":
+			run_script(sys.stdin, options.jobs)
+		else:
+			with open(options.script, encoding = "utf-8") as file:
+				run_script(file, options.jobs)
+		exit()
+	
+	if options.watch:
+		if not options.username:
+			exit("--watch needs --username")
+		if not login(options.username, os.environ.get("TODO_PASSWORD")):
+			exit()
+		watch()
+		exit()
+	
 	while True:
 		cmd = check_cmd(input("\n>> "))
 		match cmd[0]:
@@ -135,21 +439,11 @@ if __name__ == "__main__":
 		cmd = check_cmd(input("\n>> "))	
 		match cmd[0]:
 			case "folders" | "f":
-				response = post("get_folders", {"token": token})
-				answer = response.json()
-				if response.status_code != 200:
+				status_code, answer = cached_post("overview", {"token": token, "top": 0})
+				if status_code != 200:
 					print(answer["message"])
 				else:
-					folders = answer["list"]
-					if len(folders) == 0:
-						print("No folders")
-					else:
-						table = pt.PrettyTable()
-						table.field_names = ["№", "FOLDER NAME"]
-						for i in range(len(folders)):
-							table.add_row([i, folders[i]])
-						table.align = "l"
-						print(table)
+					print(format_folders(answer["folders"]))
 			case "create":
 				print(post("create_folder", {
 					"token": token,
@@ -167,29 +461,7 @@ if __name__ == "__main__":
 					"new_name": cmd[2]
 					}).json()["message"])
 			case "tasks" | "t":
-				response = post("get_tasks", {
-					"token": token,
-					"folder_number": cmd[1]
-					})
-				answer = response.json()
-				if response.status_code != 200:
-					print(answer["message"])
-				else:
-					tasks = answer["task_list"]
-					if len(tasks) == 0:
-						print("No tasks")
-					else:
-						table = pt.PrettyTable(hrules = pt.ALL)
-						table.field_names = ["№", "TASK"]
-						for i in range(len(tasks)):
-							nested_table = pt.PrettyTable(header = False, hrules = pt.ALL)
-							nested_table.add_rows([
-								["Content", tasks[i]["task_content"]],
-								["Deadline", tasks[i]["task_deadline"]],
-								["Priority", tasks[i]["task_priority"]],
-							])
-							table.add_row([i, nested_table])
-						print(table)
+				print_tasks(cmd[1])
 			case "new":
 				response = post("new_task", {
 					"token": token,
@@ -217,6 +489,10 @@ if __name__ == "__main__":
 					"new_priority": input("New priority: ")
 					})
 				print(f"\n{response.json()['message']}")
+			case "import":
+				print(import_tasks(cmd[1], cmd[2]))
+			case "watch":
+				watch()
 			case "?":
 				print_help()
 			case "exit":
@@ -0,0 +1,144 @@
+import json, time, queue, threading
+from urllib.parse import urlparse
+
+
+class BrokerBusy(Exception):
+	pass
+
+
+class Subscription:
+	"""Bounded queue of the events for one connection. A consumer too slow
+	to keep up loses the events that do not fit and is told to resync
+	instead, so publishers never wait on it."""
+
+	def __init__(self, max_size = 100):
+		self._queue = queue.Queue(max_size)
+		self.overflowed = False
+
+	def put(self, event):
+		try:
+			self._queue.put_nowait(event)
+		except queue.Full:
+			self.overflowed = True
+
+	def get(self, timeout = None):
+		"""The next event, a resync event after events were dropped, or None
+		once timeout seconds pass without one."""
+		if self.overflowed:
+			self.overflowed = False
+			while True:
+				try:
+					self._queue.get_nowait()
+				except queue.Empty:
+					break
+			return {"type": "resync"}
+		try:
+			return self._queue.get(timeout = timeout)
+		except queue.Empty:
+			return None
+
+
+class Broker:
+	"""Fans events out to the subscriptions of the same key in this process.
+	Each subscription occupies a thread for as long as it is open, hence
+	max_subscriptions."""
+
+	def __init__(self, queue_size = 100, max_subscriptions = 100):
+		self.queue_size = queue_size
+		self.max_subscriptions = max_subscriptions
+		self._subscriptions = {}
+		self._count = 0
+		self._lock = threading.Lock()
+
+	def subscribe(self, key):
+		subscription = Subscription(self.queue_size)
+		with self._lock:
+			if self._count >= self.max_subscriptions:
+				raise BrokerBusy()
+			self._subscriptions.setdefault(key, set()).add(subscription)
+			self._count += 1
+		return subscription
+
+	def unsubscribe(self, key, subscription):
+		with self._lock:
+			subscriptions = self._subscriptions.get(key, set())
+			if subscription in subscriptions:
+				subscriptions.discard(subscription)
+				self._count -= 1
+			if not subscriptions:
+				self._subscriptions.pop(key, None)
+
+	def deliver(self, key, event):
+		with self._lock:
+			subscriptions = list(self._subscriptions.get(key, ()))
+		for subscription in subscriptions:
+			subscription.put(event)
+
+	def deliver_all(self, event):
+		with self._lock:
+			subscriptions = [el for group in self._subscriptions.values() for el in group]
+		for subscription in subscriptions:
+			subscription.put(event)
+
+	def publish(self, key, event):
+		self.deliver(key, event)
+
+	def stats(self):
+		return {"subscriptions": self._count, "keys": len(self._subscriptions)}
+
+
+class RedisBroker(Broker):
+	"""Publishes events on a Redis channel that every worker listens to, so
+	that subscribers see the writes made by other workers. Events published
+	while Redis cannot be reached are lost; the subscribers of a worker whose
+	listener lost its connection are told to resync."""
+
+	def __init__(self, url, queue_size = 100, max_subscriptions = 100,
+			channel = "todolist:events"):
+		import redis
+		super().__init__(queue_size, max_subscriptions)
+		self.channel = channel
+		self.errors = (redis.RedisError, OSError)
+		self.client = redis.Redis.from_url(url, socket_timeout = 1)
+		self._thread = None
+		self._thread_lock = threading.Lock()
+
+	def _listen(self):
+		while True:
+			try:
+				pubsub = self.client.pubsub(ignore_subscribe_messages = True)
+				pubsub.subscribe(self.channel)
+				while True:
+					message = pubsub.get_message(timeout = 1)
+					if message:
+						key, event = json.loads(message["data"])
+						self.deliver(key, event)
+			except self.errors:
+				self.deliver_all({"type": "resync"})
+				time.sleep(1)
+
+	def subscribe(self, key):
+		# Started lazily so that each gunicorn worker listens in a thread of
+		# its own instead of one inherited from the master.
+		with self._thread_lock:
+			if not self._thread:
+				self._thread = threading.Thread(target = self._listen, daemon = True)
+				self._thread.start()
+		return super().subscribe(key)
+
+	def publish(self, key, event):
+		try:
+			self.client.publish(self.channel, json.dumps([key, event]))
+		except self.errors:
+			pass
+
+
+def open_broker(url, queue_size = 100, max_subscriptions = 100):
+	"""memory:// (or an empty URL) for events of this process only,
+	redis://host:port/db for events shared by all workers."""
+	scheme = urlparse(url).scheme if url else "memory"
+	if scheme == "memory":
+		return Broker(queue_size, max_subscriptions)
+	if scheme in ("redis", "rediss", "unix"):
+		return RedisBroker(url, queue_size, max_subscriptions)
+	raise ValueError(f"Unsupported event broker URL: {url}")
@@ -0,0 +1,98 @@
+import bcrypt, os, threading, time, random, tempfile, fcntl
+from concurrent.futures import ProcessPoolExecutor
+
+
+ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# Where the slot files shared by every worker on the machine are kept
+LOCK_DIR = os.environ.get("HASHING_LOCK_DIR",
+	os.path.join(tempfile.gettempdir(), "todolist-hashing"))
+
+
+class HashingBusy(Exception):
+	pass
+
+
+def _hash(password, rounds):
+	return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+	return bcrypt.checkpw(password, hashed)
+
+
+class SlotFiles:
+	"""Semaphore shared by the processes of one machine, whether or not
+	they were forked from a common parent: a slot is held by a POSIX lock
+	on one of count files, and by a thread lock within the process. POSIX
+	locks are not inherited by the processes the hashing pool forks, and
+	the kernel releases those of a process that dies."""
+
+	def __init__(self, directory, count):
+		os.makedirs(directory, exist_ok = True)
+		self._files = [os.open(os.path.join(directory, f"slot{index}.lock"),
+			os.O_RDWR | os.O_CREAT) for index in range(count)]
+		self._locks = [threading.Lock() for _ in range(count)]
+
+	def acquire(self):
+		"""Returns the index of a free slot, or None when all are held."""
+		start = random.randrange(len(self._files))
+		for index in [*range(start, len(self._files)), *range(start)]:
+			if not self._locks[index].acquire(blocking = False):
+				continue
+			try:
+				fcntl.lockf(self._files[index], fcntl.LOCK_EX | fcntl.LOCK_NB)
+				return index
+			except OSError:
+				self._locks[index].release()
+		return None
+
+	def release(self, index):
+		fcntl.lockf(self._files[index], fcntl.LOCK_UN)
+		self._locks[index].release()
+
+
+class HashingPool:
+	"""Runs bcrypt in worker processes, rejecting work once max_pending
+	calls are already queued or running in all the server's workers
+	together. A sync worker has a single request in flight, so a limit of
+	each worker's own would never reject one and a login burst would still
+	hold every worker while it waits for bcrypt."""
+
+	def __init__(self, workers = None, max_pending = None, rounds = ROUNDS,
+			lock_dir = LOCK_DIR):
+		self.workers = workers or os.cpu_count() or 1
+		self.rounds = rounds
+		self._executor = None
+		self._executor_lock = threading.Lock()
+		self._slots = SlotFiles(lock_dir, max_pending or self.workers)
+		# Callbacks run with the duration in seconds of every hash or check
+		self.listeners = []
+
+	def _get_executor(self):
+		# Created lazily so that each gunicorn worker forks its own pool
+		# after startup instead of inheriting the master's.
+		with self._executor_lock:
+			if not self._executor:
+				self._executor = ProcessPoolExecutor(self.workers)
+			return self._executor
+
+	def _run(self, fn, *args):
+		slot = self._slots.acquire()
+		if slot is None:
+			raise HashingBusy()
+		start = time.perf_counter()
+		try:
+			return self._get_executor().submit(fn, *args).result()
+		finally:
+			self._slots.release(slot)
+			for listener in self.listeners:
+				listener(time.perf_counter() - start)
+
+	def hash(self, password):
+		return self._run(_hash, password.encode(), self.rounds)
+
+	def check(self, password, hashed):
+		return self._run(_check, password.encode(), bytes(hashed))
+
+	def needs_rehash(self, hashed):
+		return int(bytes(hashed).split(b"$")[2]) != self.rounds
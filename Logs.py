@@ -0,0 +1,109 @@
+import os, copy, json, queue, random, atexit, logging, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, \
+	TimedRotatingFileHandler, WatchedFileHandler
+
+
+# Attributes every LogRecord has; anything else was passed through extra.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+	"""One JSON object per line with the standard fields followed by
+	everything passed through extra (request_id, route, user_id, ...)."""
+
+	def format(self, record):
+		entry = {
+			"time": datetime.datetime.fromtimestamp(record.created,
+				datetime.timezone.utc).isoformat(timespec = "milliseconds"),
+			"level": record.levelname,
+			"logger": record.name,
+			"message": record.getMessage()
+		}
+		for key, value in vars(record).items():
+			if key not in RECORD_ATTRIBUTES:
+				entry[key] = value
+		if record.exc_info:
+			entry["exception"] = self.formatException(record.exc_info)
+		elif record.exc_text:
+			entry["exception"] = record.exc_text
+		return json.dumps(entry, default = str)
+
+
+class SamplingFilter(logging.Filter):
+	"""Passes a random share of the records below WARNING, all others."""
+
+	def __init__(self, rate):
+		super().__init__()
+		self.rate = rate
+
+	def filter(self, record):
+		return record.levelno >= logging.WARNING or self.rate >= 1 or \
+			random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+	"""Drops records instead of blocking once the queue is full."""
+
+	def __init__(self, log_queue):
+		super().__init__(log_queue)
+		self.dropped = 0
+
+	def prepare(self, record):
+		# Unlike QueueHandler.prepare, keeps the traceback out of the message
+		# so that it ends up in its own field.
+		record = copy.copy(record)
+		record.msg = record.getMessage()
+		record.args = None
+		if record.exc_info:
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+	def enqueue(self, record):
+		try:
+			self.queue.put_nowait(record)
+		except queue.Full:
+			self.dropped += 1
+
+
+def log_path():
+	"""LOG_FILE, one file per process by default. A process rotating a file
+	that other gunicorn workers still write to leaves their records in the
+	renamed file, to be lost once old files are pruned. With
+	LOG_ROTATE=external all processes share one file instead."""
+	default = "ToDoList.log" if os.environ.get("LOG_ROTATE") == "external" \
+		else "ToDoList.{pid}.log"
+	return os.environ.get("LOG_FILE", default).format(pid = os.getpid())
+
+
+def file_handler(path):
+	rotate = os.environ.get("LOG_ROTATE", "size")
+	if rotate == "external":
+		# Rotated by logrotate or the like; every process reopens the file
+		# once it has been renamed.
+		return WatchedFileHandler(path)
+	if rotate == "time":
+		return TimedRotatingFileHandler(path,
+			when = os.environ.get("LOG_ROTATE_WHEN", "midnight"),
+			backupCount = int(os.environ.get("LOG_BACKUPS", 7)))
+	return RotatingFileHandler(path,
+		maxBytes = int(float(os.environ.get("LOG_MAX_MB", 10)) * 1024 * 1024),
+		backupCount = int(os.environ.get("LOG_BACKUPS", 7)))
+
+
+def setup_logging():
+	"""Sends records of the root logger through a bounded queue to a
+	rotating JSON file written by a background thread."""
+	handler = file_handler(log_path())
+	handler.setFormatter(JsonFormatter())
+	queue_handler = DroppingQueueHandler(
+		queue.Queue(int(os.environ.get("LOG_QUEUE_SIZE", 10000))))
+	queue_handler.addFilter(SamplingFilter(
+		float(os.environ.get("LOG_SAMPLE_RATE", 1))))
+	root = logging.getLogger()
+	root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+	root.addHandler(queue_handler)
+	listener = QueueListener(queue_handler.queue, handler)
+	listener.start()
+	atexit.register(listener.stop)
+	return queue_handler
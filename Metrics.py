@@ -0,0 +1,148 @@
+import os, sys, time, threading, heapq
+from collections import Counter as StackCounter
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+	1, 2.5, 5, 10)
+
+
+def format_labels(names, values):
+	if not names:
+		return ""
+	pairs = []
+	for name, value in zip(names, values):
+		value = str(value).replace("\\", "\\\\").replace("\"", "\\\"") \
+			.replace("\n", "\\n")
+		pairs.append(f"{name}=\"{value}\"")
+	return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+	"""Thread-safe Prometheus counter with a fixed set of label names."""
+
+	def __init__(self, name, documentation, labels = ()):
+		self.name = name
+		self.documentation = documentation
+		self.labels = tuple(labels)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def inc(self, *labels, amount = 1):
+		with self._lock:
+			self._values[labels] = self._values.get(labels, 0) + amount
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.documentation}",
+			f"# TYPE {self.name} counter"]
+		with self._lock:
+			for labels, value in sorted(self._values.items()):
+				lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+		return lines
+
+
+class Histogram:
+	"""Thread-safe Prometheus histogram with a fixed set of label names."""
+
+	def __init__(self, name, documentation, labels = (), buckets = DEFAULT_BUCKETS):
+		self.name = name
+		self.documentation = documentation
+		self.labels = tuple(labels)
+		self.buckets = tuple(sorted(buckets))
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def observe(self, value, *labels):
+		with self._lock:
+			# Per label set: a count for each bucket, then the total count and sum
+			counts = self._values.setdefault(labels, [0] * len(self.buckets) + [0, 0.0])
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					counts[i] += 1
+			counts[-2] += 1
+			counts[-1] += value
+
+	def render(self):
+		lines = [f"# HELP {self.name} {self.documentation}",
+			f"# TYPE {self.name} histogram"]
+		names = self.labels + ("le",)
+		with self._lock:
+			for labels, counts in sorted(self._values.items()):
+				for bound, count in zip(self.buckets, counts):
+					lines.append(f"{self.name}_bucket"
+						f"{format_labels(names, labels + (bound,))} {count}")
+				lines.append(f"{self.name}_bucket"
+					f"{format_labels(names, labels + ('+Inf',))} {counts[-2]}")
+				lines.append(f"{self.name}_count"
+					f"{format_labels(self.labels, labels)} {counts[-2]}")
+				lines.append(f"{self.name}_sum"
+					f"{format_labels(self.labels, labels)} {counts[-1]}")
+		return lines
+
+
+def render(metrics):
+	return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+class SlowRequestProfiler:
+	"""Samples the stacks of threads serving requests every interval seconds
+	and writes the folded stacks (flamegraph.pl / speedscope input) of the
+	slowest keep requests seen so far to directory."""
+
+	def __init__(self, keep = 10, interval = 0.005, directory = "profiles"):
+		self.keep = keep
+		self.interval = interval
+		self.directory = directory
+		self._active = {}
+		self._slowest = []
+		self._lock = threading.Lock()
+		self._thread = None
+
+	def _sample(self):
+		while True:
+			time.sleep(self.interval)
+			frames = sys._current_frames()
+			with self._lock:
+				for ident, stacks in self._active.items():
+					frame = frames.get(ident)
+					if frame is None:
+						continue
+					stack = []
+					while frame is not None:
+						code = frame.f_code
+						stack.append(f"{code.co_name} "
+							f"({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+						frame = frame.f_back
+					stacks[";".join(reversed(stack))] += 1
+
+	def start(self):
+		with self._lock:
+			if not self._thread:
+				os.makedirs(self.directory, exist_ok = True)
+				self._thread = threading.Thread(target = self._sample, daemon = True)
+				self._thread.start()
+			self._active[threading.get_ident()] = StackCounter()
+
+	def cancel(self):
+		with self._lock:
+			self._active.pop(threading.get_ident(), None)
+
+	def finish(self, name, seconds):
+		with self._lock:
+			stacks = self._active.pop(threading.get_ident(), None)
+			if not stacks:
+				return
+			if len(self._slowest) >= self.keep:
+				if seconds <= self._slowest[0][0]:
+					return
+				evicted = heapq.heappop(self._slowest)
+				try:
+					os.remove(evicted[1])
+				except OSError:
+					pass
+			path = os.path.join(self.directory, "{:.0f}ms-{}-{}.folded".format(
+				seconds * 1000, name.strip("/").replace("/", "_") or "root",
+				time.time_ns()))
+			heapq.heappush(self._slowest, (seconds, path))
+			with open(path, "w") as file:
+				for stack, count in stacks.items():
+					file.write(f"{stack} {count}\n")
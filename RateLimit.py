@@ -0,0 +1,97 @@
+import time, threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+def parse_limits(spec):
+	"""Parses "route=count/seconds[:burst],..." into {route: (rate, burst)}
+	with rate in requests per second. The route "*" applies to all routes
+	without a limit of their own."""
+	limits = {}
+	for item in filter(None, (el.strip() for el in spec.split(","))):
+		route, limit = item.split("=")
+		limit, _, burst = limit.partition(":")
+		count, _, seconds = limit.partition("/")
+		rate = float(count) / float(seconds or 1)
+		limits[route.strip().strip("/")] = (rate, float(burst or count))
+	return limits
+
+
+class RateLimiter:
+	"""Token buckets of this process. The least recently used buckets are
+	dropped beyond max_keys, which only ever lets a client through earlier."""
+
+	def __init__(self, max_keys = 100000):
+		self.max_keys = max_keys
+		self._buckets = OrderedDict()
+		self._lock = threading.Lock()
+
+	def acquire(self, key, rate, burst):
+		"""Takes a token from the bucket of key; returns 0 on success or the
+		seconds until a token is available."""
+		now = time.monotonic()
+		with self._lock:
+			tokens, last = self._buckets.get(key) or (burst, now)
+			tokens = min(burst, tokens + (now - last) * rate)
+			wait = 0
+			if tokens >= 1:
+				tokens -= 1
+			else:
+				wait = (1 - tokens) / rate
+			self._buckets[key] = (tokens, now)
+			self._buckets.move_to_end(key)
+			if len(self._buckets) > self.max_keys:
+				self._buckets.popitem(last = False)
+		return wait
+
+
+# Same algorithm as RateLimiter.acquire, run atomically by Redis on the
+# server's clock. Floats are returned as strings since Lua numbers are
+# truncated to integers.
+ACQUIRE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "time")
+local tokens = tonumber(state[1]) or burst
+local last = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - last) * rate)
+local wait = 0
+if tokens >= 1 then
+	tokens = tokens - 1
+else
+	wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "time", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+	"""Token buckets shared by all workers through Redis. Requests are let
+	through while Redis cannot be reached."""
+
+	def __init__(self, url, prefix = "todolist:limit:"):
+		import redis
+		self.prefix = prefix
+		self.errors = (redis.RedisError, OSError)
+		self.client = redis.Redis.from_url(url, socket_timeout = 1)
+		self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+
+	def acquire(self, key, rate, burst):
+		try:
+			return float(self._acquire([self.prefix + key], [rate, burst]))
+		except self.errors:
+			return 0
+
+
+def open_rate_limiter(url):
+	"""memory:// (or an empty URL) for buckets of this process,
+	redis://host:port/db for buckets shared by all workers."""
+	scheme = urlparse(url).scheme if url else "memory"
+	if scheme == "memory":
+		return RateLimiter()
+	if scheme in ("redis", "rediss", "unix"):
+		return RedisRateLimiter(url)
+	raise ValueError(f"Unsupported rate limit store URL: {url}")
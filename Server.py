@@ -1,15 +1,217 @@
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context, g, has_request_context
 from flask_restx import Api, fields, Resource
 from flask_restx.reqparse import RequestParser
-from Database import User, Folder, Task
-import jwt, datetime, logging, bcrypt
-from functools import wraps
+from werkzeug.datastructures import FileStorage
+from werkzeug.middleware.proxy_fix import ProxyFix
+from Database import db, User, Folder, Task, TaskIndex, ChangeLog, ChangeLogState, \
+	user_listeners, UserMoved, query_listeners, task_fields, parse_deadline, parse_priority, compact_change_log, \
+	lock_change_log, change_log_cursor, write_transaction, on_commit, stream_rows, backup_database, shards, set_shard, \
+	use_shard, directory_db, locate_user, assign_shard, close_connections, rebalance_shards, NO_DEADLINE, \
+	SEARCH_ENABLED
+from peewee import chunked, fn, prefetch, JOIN, DoesNotExist, OperationalError
+from Cache import LRUCache, open_cache
+from Hashing import HashingPool, HashingBusy
+from Events import open_broker, BrokerBusy
+from RateLimit import open_rate_limiter, parse_limits
+from Metrics import Counter, Histogram, SlowRequestProfiler, render
+from Logs import setup_logging
+import jwt, datetime, logging, os, json, base64, hashlib, hmac, time, uuid, gzip, math, \
+	csv, io, click
+from functools import wraps, partial
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
 
 
 app = Flask(__name__)
 app.secret_key = "F1M%7rJxvdi56-jZC%859uq6N(o&N24f9u)1(ryI"
-logging.basicConfig(filename = "ToDoList.log", level = logging.DEBUG, 
-	format = "[%(asctime)s] %(levelname)s - %(message)s")
+# Reverse proxies in front of the service. The client address is taken from
+# the X-Forwarded-For entry the outermost of them added; entries further
+# left are up to the client and never trusted.
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES:
+	app.wsgi_app = ProxyFix(app.wsgi_app, x_for = TRUSTED_PROXIES)
+log_handler = setup_logging()
+access_log = logging.getLogger("ToDoList.access")
+
+
+# Decoded tokens are kept until they expire, resolved users for a short TTL
+# so that changes made by other workers are picked up eventually.
+token_cache = LRUCache(int(os.environ.get("TOKEN_CACHE_SIZE", 4096)))
+user_cache = LRUCache(int(os.environ.get("USER_CACHE_SIZE", 1024)),
+	ttl = float(os.environ.get("USER_CACHE_TTL", 60)))
+user_listeners.append(lambda user:
+	user_cache.delete_where(lambda key: key[0] == user.username))
+
+# Listing responses by ETag. ETags change with the user and folder versions
+# that every write bumps, so entries of a changed listing are never read
+# again, whichever worker made the change.
+listing_cache = open_cache(os.environ.get("LISTING_CACHE_URL", "memory://"),
+	int(os.environ.get("LISTING_CACHE_SIZE", 1024)),
+	float(os.environ.get("LISTING_CACHE_TTL", 300)))
+
+# Change events pushed to /subscribe. The in-process broker only reaches the
+# subscribers of the worker that made the change.
+broker = open_broker(os.environ.get("EVENTS_URL", "memory://"),
+	int(os.environ.get("EVENTS_QUEUE_SIZE", 100)),
+	int(os.environ.get("EVENTS_MAX_SUBSCRIPTIONS", 100)))
+EVENTS_KEEPALIVE = float(os.environ.get("EVENTS_KEEPALIVE", 15))
+
+# HASHING_QUEUE bounds the hashes queued or running in all workers of the
+# machine together, one per core by default. Keep it below the number of
+# workers: logins beyond it answer 503 instead of holding a worker.
+hashing_pool = HashingPool(
+	int(os.environ.get("HASHING_WORKERS", 0)) or None,
+	int(os.environ.get("HASHING_QUEUE", 0)) or None
+)
+
+
+# Per-request timings, exported on /metrics. With several gunicorn workers
+# every worker process keeps its own figures.
+ROUTE_LABELS = ("route", "method")
+request_counter = Counter("todolist_requests_total",
+	"Requests served", ROUTE_LABELS + ("status",))
+request_seconds = Histogram("todolist_request_seconds",
+	"Wall time spent serving a request", ROUTE_LABELS)
+sql_statements = Histogram("todolist_request_sql_statements",
+	"SQL statements executed per request", ROUTE_LABELS,
+	buckets = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250))
+sql_seconds = Histogram("todolist_request_sql_seconds",
+	"Time spent executing SQL per request", ROUTE_LABELS)
+bcrypt_seconds = Histogram("todolist_request_bcrypt_seconds",
+	"Time spent hashing or checking passwords per request", ROUTE_LABELS)
+jwt_seconds = Histogram("todolist_request_jwt_seconds",
+	"Time spent encoding or decoding tokens per request", ROUTE_LABELS)
+REQUEST_METRICS = (request_counter, request_seconds, sql_statements,
+	sql_seconds, bcrypt_seconds, jwt_seconds)
+
+# Opt-in: PROFILE_SLOWEST=N keeps sampled stacks of the N slowest requests.
+profiler = SlowRequestProfiler(
+	int(os.environ.get("PROFILE_SLOWEST", 10)),
+	float(os.environ.get("PROFILE_INTERVAL_MS", 5)) / 1000,
+	os.environ.get("PROFILE_DIR", "profiles")
+) if int(os.environ.get("PROFILE_SLOWEST", 0)) > 0 else None
+
+
+def add_timing(name, seconds):
+	if has_request_context() and "timings" in g:
+		g.timings[name] += seconds
+
+
+def record_query(sql, seconds):
+	add_timing("sql_statements", 1)
+	add_timing("sql_seconds", seconds)
+
+
+query_listeners.append(record_query)
+hashing_pool.listeners.append(lambda seconds: add_timing("bcrypt_seconds", seconds))
+
+
+@app.before_request
+def open_connection():
+	g.started = time.perf_counter()
+	g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+	g.timings = dict.fromkeys(("sql_statements", "sql_seconds", "bcrypt_seconds",
+		"jwt_seconds"), 0)
+	if profiler:
+		profiler.start()
+	# Connections are opened on first use, on the shard of the request's user
+	set_shard(0)
+
+
+# Token buckets per route: for users by check_token, for client addresses
+# before every request. The in-process store limits each worker separately.
+rate_limiter = open_rate_limiter(os.environ.get("RATE_LIMIT_URL", "memory://"))
+USER_LIMITS = parse_limits(os.environ.get("RATE_LIMITS_USER", "*=50/1:100"))
+IP_LIMITS = parse_limits(os.environ.get("RATE_LIMITS_IP",
+	"login=10/60,registration=5/60"))
+
+
+def rate_limited(limits, identity):
+	route = request.url_rule.rule.strip("/") if request.url_rule else ""
+	rule = route if route in limits else "*"
+	if rule not in limits:
+		return None
+	wait = rate_limiter.acquire(f"{rule}:{identity}", *limits[rule])
+	if wait:
+		return {"message": "Too many requests"}, 429, \
+			{"Retry-After": str(math.ceil(wait))}
+	return None
+
+
+@app.before_request
+def limit_address():
+	return rate_limited(IP_LIMITS, f"ip:{request.remote_addr}")
+
+
+@app.after_request
+def record_request(response):
+	if "timings" in g:
+		elapsed = time.perf_counter() - g.started
+		labels = (request.url_rule.rule if request.url_rule else "unmatched",
+			request.method)
+		request_counter.inc(*labels, response.status_code)
+		request_seconds.observe(elapsed, *labels)
+		sql_statements.observe(g.timings["sql_statements"], *labels)
+		sql_seconds.observe(g.timings["sql_seconds"], *labels)
+		bcrypt_seconds.observe(g.timings["bcrypt_seconds"], *labels)
+		jwt_seconds.observe(g.timings["jwt_seconds"], *labels)
+		if profiler:
+			profiler.finish(labels[0], elapsed)
+		access_log.info("%s %s %s", request.method, request.path,
+			response.status_code, extra = {
+				"request_id": g.request_id,
+				"route": labels[0],
+				"status": response.status_code,
+				"user_id": g.get("user_id"),
+				"latency_ms": round(elapsed * 1000, 3),
+				"sql_statements": g.timings["sql_statements"]
+			})
+		response.headers["X-Request-ID"] = g.request_id
+	return response
+
+
+@app.teardown_request
+def close_connection(exception):
+	if profiler:
+		profiler.cancel()
+	close_connections()
+
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+
+
+@app.after_request
+def compress_response(response):
+	# Listings are negotiated by both Accept (representation) and Accept-Encoding
+	response.vary.update(("Accept", "Accept-Encoding"))
+	if response.status_code != 200 or response.is_streamed or \
+			response.direct_passthrough or "Content-Encoding" in response.headers or \
+			(response.content_length or 0) < COMPRESS_MIN_SIZE:
+		return response
+	encoding = request.accept_encodings.best_match(
+		["br", "gzip"] if brotli else ["gzip"])
+	if encoding == "br":
+		response.set_data(brotli.compress(response.get_data(),
+			quality = min(COMPRESS_LEVEL, 11)))
+	elif encoding == "gzip":
+		response.set_data(gzip.compress(response.get_data(), COMPRESS_LEVEL))
+	else:
+		return response
+	response.headers["Content-Encoding"] = encoding
+	# Another encoding of the same content: only weakly equal
+	etag, weak = response.get_etag()
+	if etag and not weak:
+		response.set_etag(etag, weak = True)
+	return response
+
 		
 api = Api(
 	app,
@@ -18,11 +220,91 @@ api = Api(
 	default = "ToDoList"
 )
 
+COLUMNAR_MEDIATYPE = "application/vnd.todolist.columnar+json"
+MSGPACK_MEDIATYPE = "application/msgpack"
+
+
+def columnar(data):
+	"""Replaces every list of objects with {"columns": [...], "values": [...]},
+	one array of values per field, so that field names are not repeated."""
+	if isinstance(data, dict):
+		return {key: columnar(value) for key, value in data.items()}
+	if isinstance(data, list) and data and all(isinstance(el, dict) for el in data):
+		columns = list(dict.fromkeys(key for el in data for key in el))
+		return {"columns": columns,
+			"values": [[columnar(el.get(key)) for el in data] for key in columns]}
+	if isinstance(data, list):
+		return [columnar(el) for el in data]
+	return data
+
+
+@api.representation(COLUMNAR_MEDIATYPE)
+def output_columnar(data, code, headers = None):
+	return Response(json.dumps(columnar(data), separators = (",", ":")),
+		code, headers, mimetype = COLUMNAR_MEDIATYPE)
+
+
+if msgpack:
+	@api.representation(MSGPACK_MEDIATYPE)
+	def output_msgpack(data, code, headers = None):
+		return Response(msgpack.packb(columnar(data)), code, headers,
+			mimetype = MSGPACK_MEDIATYPE)
+
+
 message_model = api.model("message", {
 	"message": fields.String
 })
 list_model = api.model("list", {
-	"list": fields.List(fields.String)
+	"list": fields.List(fields.String),
+	"ids": fields.List(fields.Integer)
+})
+folder_task_model = api.model("folder_task", {
+	"task_id": fields.Integer,
+	"folder_id": fields.Integer,
+	"task_content": fields.String,
+	"task_deadline": fields.String,
+	"task_priority": fields.String
+})
+folder_task_list_model = api.model("folder_task_list", {
+	"task_list": fields.List(fields.Nested(folder_task_model))
+})
+sync_model = api.model("sync", {
+	"cursor": fields.Integer,
+	"reset": fields.Boolean,
+	"folders": fields.List(fields.Nested(
+		api.model("sync_folder", {
+			"folder_id": fields.Integer,
+			"folder_name": fields.String
+		})
+	)),
+	"tasks": fields.List(fields.Nested(folder_task_model)),
+	"deleted_folders": fields.List(fields.Integer),
+	"deleted_tasks": fields.List(fields.Integer)
+})
+batch_result_model = api.model("batch_result", {
+	"results": fields.List(fields.Nested(
+		api.model("batch_item", {
+			"status": fields.Integer,
+			"message": fields.String
+		})
+	))
+})
+import_model = api.model("import", {
+	"folders": fields.Integer,
+	"tasks": fields.Integer
+})
+cache_stats_model = api.model("cache_stats", {
+	"size": fields.Integer,
+	"hits": fields.Integer,
+	"misses": fields.Integer,
+	"hit_ratio": fields.Float
+})
+stats_model = api.model("stats", {
+	"token_cache": fields.Nested(cache_stats_model),
+	"user_cache": fields.Nested(cache_stats_model),
+	"listing_cache": fields.Nested(cache_stats_model),
+	"event_subscriptions": fields.Integer,
+	"dropped_log_records": fields.Integer
 })
 token_model = api.model("token", {
 	"token": fields.String,
@@ -31,11 +313,23 @@ token_model = api.model("token", {
 task_list_model = api.model("task_list", {
 	"task_list": fields.List(fields.Nested(
 		api.model("task", {
+			"task_id": fields.Integer,
 			"task_content": fields.String,
 			"task_deadline": fields.String,
 			"task_priority": fields.String
 		}),
 		skip_none = True
+	)),
+	"next_cursor": fields.String
+})
+overview_model = api.model("overview", {
+	"folders": fields.List(fields.Nested(
+		api.model("overview_folder", {
+			"folder_id": fields.Integer,
+			"folder_name": fields.String,
+			"task_count": fields.Integer,
+			"top_tasks": fields.List(fields.Nested(api.models["task"]))
+		})
 	))
 })
 
@@ -43,33 +337,283 @@ task_list_model = api.model("task_list", {
 def create_token(username, lifetime_minutes = 30):
 	expire = datetime.datetime.utcnow() + datetime.timedelta(
 		minutes = lifetime_minutes)
+	start = time.perf_counter()
 	token = jwt.encode(
 		{"username": username, "exp": expire},
 		app.secret_key,
 		algorithm = "HS256"
 	)
+	add_timing("jwt_seconds", time.perf_counter() - start)
 	if isinstance(token, bytes):
 		token = token.decode()
 	return {"token": token, "expire": expire.timestamp()}
 
 
+def busy_response():
+	return {"message": "The server is busy, try again later"}, 503, \
+		{"Retry-After": "1"}
+
+
+# Errors worth retrying: SQLite's once its busy timeout runs out, and
+# PostgreSQL's lock_not_available, deadlock_detected, serialization_failure
+# and query_canceled (lock_timeout or statement_timeout).
+BUSY_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+BUSY_PGCODES = {"55P03", "40P01", "40001", "57014"}
+
+
+def is_busy(error):
+	# peewee keeps the driver's exception as orig
+	original = getattr(error, "orig", error)
+	return getattr(original, "pgcode", None) in BUSY_PGCODES or \
+		any(message in str(original) for message in BUSY_MESSAGES)
+
+
+@api.errorhandler(OperationalError)
+def database_busy(error):
+	# Other operational errors, such as SQL a request made invalid, are a
+	# 500: clients retry a 503.
+	if not is_busy(error):
+		raise error
+	logging.getLogger(__name__).warning("Database busy: %s", error)
+	return busy_response()
+
+
+@api.errorhandler(UserMoved)
+def user_moved(error):
+	# The user was resolved from a cache entry older than the move; the
+	# retry looks them up in the directory again.
+	username = error.args[0]
+	user_cache.delete_where(lambda key: key[0] == username)
+	return busy_response()
+
+
 def check_token(f):
 	@wraps(f)
 	def wrapped(*args, **kwargs):
 		if "token" not in request.form:
 			return {"message": "Invalid request"}, 400
 		try:
-			username = jwt.decode(request.form["token"], app.secret_key,
-							algorithms = ["HS256"])["username"]
-			user = User.get_or_none(User.username == username)
-			if not user:
-				return {"message": "There is no such user"}, 410
+			payload = decode_token(request.form["token"])
 		except jwt.InvalidTokenError:
 			return {"message": "Invalid token"}, 403
+		limited = rate_limited(USER_LIMITS, f"user:{payload['username']}")
+		if limited:
+			return limited
+		
+		key = (payload["username"], payload["exp"])
+		cached = user_cache.get(key)
+		if cached:
+			shard, user = cached
+			set_shard(shard)
+		else:
+			shard = locate_user(payload["username"])
+			set_shard(shard)
+			user = User.get_or_none(User.username == payload["username"])
+			if not user:
+				return {"message": "There is no such user"}, 410
+			user_cache.set(key, (shard, user), payload["exp"])
+		g.user_id = user.user_id
 		return f(*args, **kwargs, user = user)
 	return wrapped
 
 
+def decode_token(token):
+	payload = token_cache.get(token)
+	if not payload:
+		start = time.perf_counter()
+		try:
+			payload = jwt.decode(token, app.secret_key, algorithms = ["HS256"])
+		finally:
+			add_timing("jwt_seconds", time.perf_counter() - start)
+		token_cache.set(token, payload, payload["exp"])
+	return payload
+
+
+def folders_of(user):
+	return Folder.select().where(Folder.user_id == user.user_id) \
+		.order_by(Folder.folder_id)
+
+
+# What find_folder and find_task raise for a missing row or a malformed
+# number or id. Other errors, such as a locked database, are not a 404.
+LOOKUP_ERRORS = (DoesNotExist, ValueError, TypeError)
+
+
+def find_folder(user, form, number_key = "folder_number", id_key = "folder_id"):
+	if id_key in form:
+		return Folder.get((Folder.folder_id == int(form[id_key])) &
+			(Folder.user_id == user.user_id))
+	number = int(form[number_key])
+	if number < 0:
+		raise Folder.DoesNotExist
+	folder = folders_of(user).offset(number).limit(1).first()
+	if not folder:
+		raise Folder.DoesNotExist
+	return folder
+
+
+def find_task(user, form):
+	if "task_id" in form:
+		return Task.select().join(Folder) \
+			.where((Task.task_id == int(form["task_id"])) &
+				(Folder.user_id == user.user_id)).get()
+	folder = find_folder(user, form)
+	number = int(form["task_number"])
+	if number < 0:
+		raise Task.DoesNotExist
+	task = Task.select().where(Task.folder_id == folder.folder_id) \
+		.order_by(Task.task_id).offset(number).limit(1).first()
+	if not task:
+		raise Task.DoesNotExist
+	return task
+
+
+TASK_SORT_FIELDS = {
+	"id": Task.task_id,
+	"deadline": Task.deadline_at,
+	"priority": Task.priority_level
+}
+
+
+# Cursors are signed, so that only values the server handed out reach SQL
+def sign_cursor(data):
+	return hmac.new(app.secret_key.encode(), data.encode(), hashlib.sha256).hexdigest()
+
+
+def encode_cursor(value, task_id):
+	data = base64.urlsafe_b64encode(
+		json.dumps([value, task_id], default = str).encode()).decode()
+	return f"{data}.{sign_cursor(data)}"
+
+
+def decode_cursor(cursor):
+	data, _, signature = cursor.partition(".")
+	if not hmac.compare_digest(signature, sign_cursor(data)):
+		raise ValueError
+	value, task_id = json.loads(base64.urlsafe_b64decode(data.encode()))
+	if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+		raise ValueError
+	return value, int(task_id)
+
+
+def require(value):
+	if value is None:
+		raise ValueError
+	return value
+
+
+def current_version(user):
+	# Reads check the user row too: a cache entry from before another
+	# worker moved the user would otherwise show an empty account.
+	version = User.select(User.version) \
+		.where(User.user_id == user.user_id).scalar()
+	if version is None:
+		raise UserMoved(user.username)
+	return version
+
+
+def ensure_user(user):
+	"""For reads that found nothing, which may be because the user moved."""
+	current_version(user)
+
+
+def bump_versions(user, folder_ids = ()):
+	# First in every write transaction: it locks the user row, which is gone
+	# once the user has been moved to another shard.
+	if not User.update(version = User.version + 1) \
+			.where(User.user_id == user.user_id).execute():
+		raise UserMoved(user.username)
+	if folder_ids:
+		Folder.update(version = Folder.version + 1) \
+			.where(Folder.folder_id.in_(list(set(folder_ids)))).execute()
+
+
+def log_changes(user, kind, object_ids, deleted = False):
+	rows = [{"user_id": user.user_id, "kind": kind, "object_id": object_id,
+		"deleted": deleted} for object_id in object_ids]
+	if rows:
+		lock_change_log()
+	for chunk in chunked(rows, 100):
+		ChangeLog.insert_many(chunk).execute()
+	if object_ids:
+		# Subscribers only hear of changes that were committed
+		on_commit(partial(broker.publish, user.username, {"type": kind,
+			"ids": list(object_ids), "deleted": deleted}))
+
+
+def make_etag(user, *parts):
+	form = {k: v for k, v in request.form.items() if k != "token"}
+	mediatype = request.accept_mimetypes.best_match(api.representations)
+	# Also the key of the listing cache, which every user shares. Ids are
+	# only unique within a shard.
+	return hashlib.sha1(json.dumps([request.path, form, mediatype, db.shard.get(),
+		user.user_id, *parts], sort_keys = True).encode()).hexdigest()
+
+
+def cached_listing(etag):
+	payload = listing_cache.get(etag)
+	if payload is None:
+		return None
+	return json.loads(payload), 200, {"ETag": f'"{etag}"'}
+
+
+def cache_listing(etag, payload):
+	listing_cache.set(etag, json.dumps(payload))
+	return payload, 200, {"ETag": f'"{etag}"'}
+
+
+def not_modified(etag):
+	if request.if_none_match.contains_weak(etag):
+		response = Response(status = 304)
+		response.set_etag(etag)
+		return response
+	return None
+
+
+def search_expression(text):
+	# Every word is quoted so that FTS5 operators in user input are
+	# matched literally.
+	return " ".join('"%s"' % word.replace('"', '""') for word in text.split())
+
+
+def task_to_dict(el):
+	return {
+		"task_id": el["task_id"],
+		"task_content": el["task_content"],
+		"task_deadline": el["task_deadline"],
+		"task_priority": el["task_priority"]
+	}
+
+
+def has_folder(form, number_key = "folder_number", id_key = "folder_id"):
+	return number_key in form or id_key in form
+
+
+def has_task(form):
+	return "task_id" in form or (has_folder(form) and "task_number" in form)
+
+
+@api.route("/stats")
+class Stats(Resource):
+	@api.response(200, "Success", stats_model)
+	def get(self):
+		return {
+			"token_cache": token_cache.stats(),
+			"user_cache": user_cache.stats(),
+			"listing_cache": listing_cache.stats(),
+			"event_subscriptions": broker.stats()["subscriptions"],
+			"dropped_log_records": log_handler.dropped
+		}, 200
+
+
+@api.route("/metrics")
+class Metrics(Resource):
+	@api.response(200, "Success")
+	def get(self):
+		return Response(render(REQUEST_METRICS),
+			mimetype = "text/plain; version=0.0.4")
+
+
 @api.route("/update_token")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
@@ -79,6 +623,7 @@ class UpdateToken(Resource):
 	@api.response(400, "Invalid request", message_model)
 	@api.response(403, "Invalid token", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
 	@check_token
 	def post(self, user):
 		return create_token(user.username), 200
@@ -93,16 +638,22 @@ class UserRegistration(Resource):
 	@api.response(200, "Success", token_model)
 	@api.response(400, "Invalid request", message_model)
 	@api.response(401, "This username is already taken", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	def post(self):
 		f = request.form
 		if not ("username" in f and "password" in f):
 			return {"message": "Invalid request"}, 400
 		
+		set_shard(assign_shard(f["username"]))
 		user = User.get_or_none(User.username == f['username'])
 		if user:
 			return {"message": "This username is already taken"}, 401
-		new_user = User.create(username = f["username"],
-			password = bcrypt.hashpw(f["password"].encode(), bcrypt.gensalt()))
+		try:
+			password = hashing_pool.hash(f["password"])
+		except HashingBusy:
+			return busy_response()
+		new_user = User.create(username = f["username"], password = password)
 		Folder.create(folder_name = "Default", user_id = new_user.user_id)
 		
 		return create_token(f['username']), 200
@@ -117,15 +668,23 @@ class UserLogin(Resource):
 	@api.response(200, "Success", token_model)
 	@api.response(400, "Invalid request", message_model)
 	@api.response(401, "The username or password is incorrect", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	def post(self):
 		f = request.form
 		if not ("username" in f and "password" in f):
 			return {"message": "Invalid request"}, 400
 		
+		set_shard(locate_user(f["username"]))
 		user = User.get_or_none(User.username == f["username"])
-		if user:
-			if bcrypt.checkpw(f["password"].encode(), user.password):
+		try:
+			if user and hashing_pool.check(f["password"], user.password):
+				if hashing_pool.needs_rehash(user.password):
+					user.password = hashing_pool.hash(f["password"])
+					user.save(only = [User.password])
 				return create_token(f["username"]), 200
+		except HashingBusy:
+			return busy_response()
 		
 		return {"message": "The username or password is incorrect"}, 401
 
@@ -136,14 +695,82 @@ class UserLogin(Resource):
 )
 class GetFolders(Resource):
 	@api.response(200, "Success", list_model)
+	@api.response(304, "Not modified")
 	@api.response(403, "Invalid token", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
-		result = []
-		for el in list(Folder.select().where(Folder.user_id == user.user_id)):
-			result.append(el.folder_name)
-		return {"list": result}, 200
+		etag = make_etag(user, current_version(user))
+		response = not_modified(etag) or cached_listing(etag)
+		if response:
+			return response
+		
+		names, ids = [], []
+		for el in folders_of(user).select(Folder.folder_id, Folder.folder_name).tuples():
+			ids.append(el[0])
+			names.append(el[1])
+		return cache_listing(etag, {"list": names, "ids": ids})
+
+
+@api.route("/overview")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "top", type = int, location = "form",
+		help = "Tasks per folder by deadline and priority, 3 by default and at most 20")
+)
+class Overview(Resource):
+	@api.response(200, "Success", overview_model)
+	@api.response(304, "Not modified")
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		try:
+			top = int(request.form.get("top", 3))
+			if not 0 <= top <= 20:
+				raise ValueError
+		except ValueError:
+			return {"message": "Invalid request"}, 400
+		
+		etag = make_etag(user, current_version(user))
+		response = not_modified(etag) or cached_listing(etag)
+		if response:
+			return response
+		
+		# Two queries whatever the number of folders: folders with their task
+		# counts, then the first top tasks of every folder ranked in SQL.
+		folders = Folder.select(Folder.folder_id, Folder.folder_name,
+				fn.COUNT(Task.task_id).alias("task_count")) \
+			.join(Task, JOIN.LEFT_OUTER) \
+			.where(Folder.user_id == user.user_id) \
+			.group_by(Folder.folder_id) \
+			.order_by(Folder.folder_id)
+		if top:
+			rank = fn.ROW_NUMBER().over(partition_by = [Task.folder_id],
+				order_by = [Task.deadline_at, Task.priority_level.desc(), Task.task_id])
+			ranked = Task.select(Task.task_id, rank.alias("task_rank")) \
+				.join(Folder) \
+				.where(Folder.user_id == user.user_id) \
+				.alias("ranked")
+			tasks = Task.select(Task.task_id, Task.folder_id, Task.task_content,
+					Task.task_deadline, Task.task_priority) \
+				.join(ranked, on = (Task.task_id == ranked.c.task_id)) \
+				.where(ranked.c.task_rank <= top) \
+				.order_by(ranked.c.task_rank)
+			folders = prefetch(folders, tasks)
+		
+		return cache_listing(etag, {"folders": [{
+			"folder_id": folder.folder_id,
+			"folder_name": folder.folder_name,
+			"task_count": folder.task_count,
+			"top_tasks": [task_to_dict(task.__data__) for task in folder.task_set]
+				if top else []
+			} for folder in folders]})
 
 
 @api.route("/create_folder")
@@ -157,6 +784,8 @@ class CreateFolder(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(409, "The folder already exists", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
@@ -167,7 +796,10 @@ class CreateFolder(Resource):
 								Folder.folder_name == f["folder_name"])
 		if folder:
 			return {"message": "The folder already exists"}, 409
-		Folder.create(user_id = user.user_id, folder_name = f["folder_name"])
+		with write_transaction():
+			bump_versions(user)
+			folder = Folder.create(user_id = user.user_id, folder_name = f["folder_name"])
+			log_changes(user, "folder", [folder.folder_id])
 		return {"message": "The folder created"}, 200
 
 
@@ -175,6 +807,7 @@ class CreateFolder(Resource):
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
 )
 class DeleteFolder(Resource):
 	@api.response(200, "The folder deleted", message_model)
@@ -182,27 +815,31 @@ class DeleteFolder(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such folder", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not "folder_number" in f:
+		if not has_folder(f):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folder = list(Folder.select()
-						.where(Folder.user_id == user.user_id))[int(f["folder_number"])]
-			for task in list(Task.select().where(Task.folder_id == folder.folder_id)):
-				task.delete_instance()
+			folder = find_folder(user, f)
+		except LOOKUP_ERRORS:
+			return {"message": "There is no such folder"}, 404
+		with write_transaction():
+			bump_versions(user)
+			Task.delete().where(Task.folder_id == folder.folder_id).execute()
 			folder.delete_instance()
-			return {"message": "The folder deleted"}, 200
-		except:
-			return {"message": "There is no such folder"}, 404	
+			log_changes(user, "folder", [folder.folder_id], deleted = True)
+		return {"message": "The folder deleted"}, 200
 
 
 @api.route("/rename_folder")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
 	.add_argument(name = "new_name", type = str, location = "form")
 )
 class RenameFolder(Resource):
@@ -211,59 +848,215 @@ class RenameFolder(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such folder", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not ("folder_number" in f and "new_name" in f):
+		if not (has_folder(f) and "new_name" in f):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folder = list(Folder.select()
-				.where(Folder.user_id == user.user_id))[int(f["folder_number"])]
-			folder.folder_name = f["new_name"]
-			folder.save()
-			return {"message": "The folder renamed"}, 200
-		except:
+			folder = find_folder(user, f)
+		except LOOKUP_ERRORS:
 			return {"message": "There is no such folder"}, 404
+		folder.folder_name = f["new_name"]
+		with write_transaction():
+			bump_versions(user)
+			folder.save(only = [Folder.folder_name])
+			log_changes(user, "folder", [folder.folder_id])
+		return {"message": "The folder renamed"}, 200
 
 
 @api.route("/get_tasks")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
+	.add_argument(name = "limit", type = int, location = "form",
+		help = "Page size; without it every matching task is returned")
+	.add_argument(name = "cursor", type = str, location = "form",
+		help = "next_cursor of the previous page")
+	.add_argument(name = "sort", type = str, location = "form",
+		help = "id, deadline or priority, prefixed with '-' for descending order")
+	.add_argument(name = "priority", type = str, location = "form")
+	.add_argument(name = "deadline_from", type = str, location = "form",
+		help = "Date such as 2024-05-31 or 31.05.2024 14:00")
+	.add_argument(name = "deadline_to", type = str, location = "form")
+	.add_argument(name = "format", type = str, location = "form",
+		help = "'ndjson' streams one task per line instead of a JSON document")
 )
 class GetTasks(Resource):
 	@api.response(200, "Success", task_list_model)
+	@api.response(304, "Not modified")
 	@api.response(400, "Invalid request", message_model)
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such folder", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not "folder_number" in f:
+		if not has_folder(f):
+			return {"message": "Invalid request"}, 400
+		try:
+			sort = f.get("sort", "id")
+			descending = sort.startswith("-")
+			field = TASK_SORT_FIELDS[sort.lstrip("-")]
+			limit = int(f["limit"]) if "limit" in f else None
+			if limit is not None and limit <= 0:
+				raise ValueError
+			cursor = decode_cursor(f["cursor"]) if "cursor" in f else None
+			filters = []
+			if "priority" in f:
+				filters.append(Task.priority_level == require(parse_priority(f["priority"])))
+			if "deadline_from" in f:
+				filters.append(Task.deadline_at >= require(parse_deadline(f["deadline_from"])))
+			if "deadline_to" in f:
+				filters.append(Task.deadline_at <= require(parse_deadline(f["deadline_to"])))
+			if "deadline_from" in f or "deadline_to" in f:
+				filters.append(Task.deadline_at < NO_DEADLINE)
+		except (KeyError, ValueError, TypeError):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folder = list(Folder.select()
-				.where(Folder.user_id == user.user_id))[int(f["folder_number"])]
-			tasks = Task.select().where(Task.folder_id == folder.folder_id).dicts().execute()
-			result = []
-			for el in tasks:
-				result.append({
-					"task_content": el["task_content"],
-					"task_deadline": el["task_deadline"],
-					"task_priority": el["task_priority"]
-				})
-			return {"task_list": result}, 200
-		except:
+			folder = find_folder(user, f)
+		except LOOKUP_ERRORS:
+			ensure_user(user)
 			return {"message": "There is no such folder"}, 404
+		etag = make_etag(user, folder.folder_id, folder.version)
+		response = not_modified(etag) or \
+			(f.get("format") != "ndjson" and cached_listing(etag))
+		if response:
+			return response
+		
+		query = Task.select(Task.task_id, Task.task_content, Task.task_deadline,
+				Task.task_priority, Task.deadline_at, Task.priority_level) \
+			.where(Task.folder_id == folder.folder_id, *filters)
+		if cursor:
+			value, task_id = cursor
+			after_id = Task.task_id < task_id if descending else Task.task_id > task_id
+			if field is Task.task_id:
+				query = query.where(after_id)
+			else:
+				after_value = field < value if descending else field > value
+				query = query.where(after_value | ((field == value) & after_id))
+		if field is Task.task_id:
+			query = query.order_by(field.desc() if descending else field)
+		else:
+			query = query.order_by(*((field.desc(), Task.task_id.desc()) if descending
+				else (field, Task.task_id)))
+		
+		if f.get("format") == "ndjson":
+			def generate():
+				for el in stream_rows(query.limit(limit).dicts()):
+					yield json.dumps(task_to_dict(el)) + "\n"
+			return Response(stream_with_context(generate()),
+				mimetype = "application/x-ndjson", headers = {"ETag": f'"{etag}"'})
+		
+		rows = list(query.limit(limit and limit + 1).dicts())
+		next_cursor = None
+		if limit and len(rows) > limit:
+			rows = rows[:limit]
+			next_cursor = encode_cursor(rows[-1][field.name], rows[-1]["task_id"])
+		return cache_listing(etag, {"task_list": [task_to_dict(el) for el in rows],
+			"next_cursor": next_cursor})
+
+
+@api.route("/upcoming_tasks")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "limit", type = int, location = "form",
+		help = "Number of tasks, 10 by default and at most 100")
+	.add_argument(name = "deadline_from", type = str, location = "form",
+		help = "Defaults to the current time")
+)
+class UpcomingTasks(Resource):
+	@api.response(200, "Success", folder_task_list_model)
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		f = request.form
+		try:
+			limit = int(f.get("limit", 10))
+			if not 0 < limit <= 100:
+				raise ValueError
+			deadline_from = require(parse_deadline(f["deadline_from"])) \
+				if "deadline_from" in f else datetime.datetime.now()
+		except (ValueError, TypeError):
+			return {"message": "Invalid request"}, 400
+		
+		tasks = Task.select(Task.task_id, Task.folder_id, Task.task_content,
+				Task.task_deadline, Task.task_priority) \
+			.join(Folder) \
+			.where((Folder.user_id == user.user_id) &
+				(Task.deadline_at >= deadline_from) & (Task.deadline_at < NO_DEADLINE)) \
+			.order_by(Task.deadline_at, Task.priority_level.desc(), Task.task_id) \
+			.limit(limit).dicts()
+		task_list = [{"folder_id": el["folder_id"], **task_to_dict(el)} for el in tasks]
+		if not task_list:
+			ensure_user(user)
+		return {"task_list": task_list}, 200
+
+
+@api.route("/search_tasks")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "query", type = str, location = "form",
+		help = "Words that must all occur in the task content")
+	.add_argument(name = "limit", type = int, location = "form",
+		help = "Number of tasks, 20 by default and at most 100")
+	.add_argument(name = "offset", type = int, location = "form")
+)
+class SearchTasks(Resource):
+	@api.response(200, "Success", folder_task_list_model)
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		f = request.form
+		try:
+			expression = search_expression(f["query"])
+			limit = int(f.get("limit", 20))
+			offset = int(f.get("offset", 0))
+			if not expression or not 0 < limit <= 100 or offset < 0:
+				raise ValueError
+		except (KeyError, ValueError):
+			return {"message": "Invalid request"}, 400
+		
+		tasks = Task.select(Task.task_id, Task.folder_id, Task.task_content,
+			Task.task_deadline, Task.task_priority)
+		if SEARCH_ENABLED:
+			tasks = tasks.join(TaskIndex, on = (TaskIndex.rowid == Task.task_id)) \
+				.switch(Task).join(Folder) \
+				.where(TaskIndex.match(expression) & (Folder.user_id == user.user_id)) \
+				.order_by(TaskIndex.bm25(), Task.task_id)
+		else:
+			words = f["query"].split()
+			tasks = tasks.join(Folder) \
+				.where(Folder.user_id == user.user_id,
+					*[Task.task_content.contains(word) for word in words]) \
+				.order_by(Task.task_id)
+		task_list = [{"folder_id": el["folder_id"], **task_to_dict(el)}
+			for el in tasks.offset(offset).limit(limit).dicts()]
+		if not task_list:
+			ensure_user(user)
+		return {"task_list": task_list}, 200
 
 
 @api.route("/new_task")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
 	.add_argument(name = "task_content", type = str, location = "form")
 	.add_argument(name = "task_deadline", type = str, location = "form")
 	.add_argument(name = "task_priority", type = str, location = "form")
@@ -274,28 +1067,34 @@ class NewTask(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such folder", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not ("folder_number" in f and "task_content" in f and
+		if not (has_folder(f) and "task_content" in f and
 			"task_deadline" in f and "task_priority" in f):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folder = list(Folder.select()
-				.where(Folder.user_id == user.user_id))[int(f["folder_number"])]
-			Task.create(folder_id = folder.folder_id, task_content = f["task_content"],
-				task_deadline = f["task_deadline"], task_priority = f["task_priority"])
-			return {"message": "The task added"}, 200
-		except:
+			folder = find_folder(user, f)
+		except LOOKUP_ERRORS:
 			return {"message": "There is no such folder"}, 404
+		with write_transaction():
+			bump_versions(user, [folder.folder_id])
+			task = Task.create(folder_id = folder.folder_id, **task_fields(
+				f["task_content"], f["task_deadline"], f["task_priority"]))
+			log_changes(user, "task", [task.task_id])
+		return {"message": "The task added"}, 200
 
 
 @api.route("/remove_task")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
 	.add_argument(name = "task_number", type = int, location = "form")
+	.add_argument(name = "task_id", type = int, location = "form")
 )
 class RemoveTask(Resource):
 	@api.response(200, "The task removed", message_model)
@@ -303,29 +1102,34 @@ class RemoveTask(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such task", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not ("folder_number" in f and "task_number" in f):
+		if not has_task(f):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folder = list(Folder.select()
-				.where(Folder.user_id == user.user_id))[int(f["folder_number"])]
-			list(Task.select()
-				.where(Task.folder_id == folder.folder_id)) \
-					[int(f["task_number"])].delete_instance()
-			return {"message": "The task removed"}, 200
-		except:
+			task = find_task(user, f)
+		except LOOKUP_ERRORS:
 			return {"message": "There is no such task"}, 404
+		with write_transaction():
+			bump_versions(user, [task.folder_id_id])
+			task.delete_instance()
+			log_changes(user, "task", [task.task_id], deleted = True)
+		return {"message": "The task removed"}, 200
 
 
 @api.route("/update_task")
 @api.expect(RequestParser()
 	.add_argument(name = "token", type = str, location = "form")
 	.add_argument(name = "folder_number", type = int, location = "form")
+	.add_argument(name = "folder_id", type = int, location = "form")
 	.add_argument(name = "task_number", type = int, location = "form")
+	.add_argument(name = "task_id", type = int, location = "form")
 	.add_argument(name = "new_folder_number", type = int, location = "form")
+	.add_argument(name = "new_folder_id", type = int, location = "form")
 	.add_argument(name = "new_content", type = str, location = "form")
 	.add_argument(name = "new_deadline", type = str, location = "form")
 	.add_argument(name = "new_priority", type = str, location = "form")
@@ -336,29 +1140,414 @@ class UpdateTask(Resource):
 	@api.response(403, "Invalid token", message_model)
 	@api.response(404, "There is no such task", message_model)
 	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
 	@check_token
 	def post(self, user):
 		f = request.form
-		if not ("folder_number" in f and "task_number" in f and
-			"new_folder_number" in f and "new_content" in f and
-			"new_deadline" in f and "new_priority" in f):
+		if not (has_task(f) and
+			has_folder(f, "new_folder_number", "new_folder_id") and
+			"new_content" in f and "new_deadline" in f and "new_priority" in f):
 			return {"message": "Invalid request"}, 400
 	
 		try:
-			folders = list(Folder.select().where(Folder.user_id == user.user_id))
-			current_folder = folders[int(f["folder_number"])]
-			new_folder = folders[int(f["new_folder_number"])]
-			task = list(Task.select()
-				.where(Task.folder_id == current_folder.folder_id))[int(f["task_number"])]
-			
-			task.folder_id = new_folder.folder_id
-			task.task_content = f["new_content"]
-			task.task_deadline = f["new_deadline"]
-			task.task_priority = f["new_priority"]
-			task.save()
-			return {"message": "The task updated"}, 200
-		except:
+			task = find_task(user, f)
+			new_folder = find_folder(user, f, "new_folder_number", "new_folder_id")
+		except LOOKUP_ERRORS:
 			return {"message": "There is no such task"}, 404
+		
+		old_folder_id = task.folder_id_id
+		task.folder_id = new_folder.folder_id
+		task.set_fields(f["new_content"], f["new_deadline"], f["new_priority"])
+		with write_transaction():
+			bump_versions(user, [old_folder_id, new_folder.folder_id])
+			task.save()
+			log_changes(user, "task", [task.task_id])
+		return {"message": "The task updated"}, 200
+
+
+@api.route("/batch_tasks")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "operations", type = str, location = "form",
+		help = "JSON array of {\"op\": \"new\" | \"remove\" | \"update\", ...} "
+			"objects with the fields of the matching single-task route. "
+			"Folder and task numbers refer to the state before the batch.")
+)
+class BatchTasks(Resource):
+	@api.response(200, "Success", batch_result_model)
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		f = request.form
+		try:
+			operations = json.loads(f["operations"])
+			if not isinstance(operations, list) or \
+					not all(isinstance(op, dict) for op in operations):
+				raise ValueError
+		except (KeyError, ValueError):
+			return {"message": "Invalid request"}, 400
+		
+		results = [None] * len(operations)
+		new_rows, updated, removed, folder_ids = [], [], [], []
+		for i, op in enumerate(operations):
+			kind = op.get("op")
+			if kind == "new" and has_folder(op) and "task_content" in op and \
+					"task_deadline" in op and "task_priority" in op:
+				try:
+					folder = find_folder(user, op)
+				except LOOKUP_ERRORS:
+					results[i] = {"status": 404, "message": "There is no such folder"}
+					continue
+				new_rows.append({"folder_id": folder.folder_id, **task_fields(
+					op["task_content"], op["task_deadline"], op["task_priority"])})
+				folder_ids.append(folder.folder_id)
+				results[i] = {"status": 200, "message": "The task added"}
+			elif kind == "remove" and has_task(op):
+				try:
+					task = find_task(user, op)
+				except LOOKUP_ERRORS:
+					results[i] = {"status": 404, "message": "There is no such task"}
+					continue
+				removed.append(task.task_id)
+				folder_ids.append(task.folder_id_id)
+				results[i] = {"status": 200, "message": "The task removed"}
+			elif kind == "update" and has_task(op) and \
+					has_folder(op, "new_folder_number", "new_folder_id") and \
+					"new_content" in op and "new_deadline" in op and "new_priority" in op:
+				try:
+					task = find_task(user, op)
+					new_folder = find_folder(user, op, "new_folder_number", "new_folder_id")
+				except LOOKUP_ERRORS:
+					results[i] = {"status": 404, "message": "There is no such task"}
+					continue
+				folder_ids += [task.folder_id_id, new_folder.folder_id]
+				task.folder_id = new_folder.folder_id
+				task.set_fields(op["new_content"], op["new_deadline"], op["new_priority"])
+				updated.append(task)
+				results[i] = {"status": 200, "message": "The task updated"}
+			else:
+				results[i] = {"status": 400, "message": "Invalid request"}
+		
+		with write_transaction():
+			if folder_ids:
+				bump_versions(user, folder_ids)
+			created = []
+			for rows in chunked(new_rows, 100):
+				created += [el.task_id for el in
+					Task.insert_many(rows).returning(Task.task_id).execute()]
+			if updated:
+				Task.bulk_update(updated, fields = [Task.folder_id, Task.task_content,
+					Task.task_deadline, Task.task_priority, Task.deadline_at,
+					Task.priority_level], batch_size = 100)
+			for ids in chunked(removed, 100):
+				Task.delete().where(Task.task_id.in_(ids)).execute()
+			log_changes(user, "task", created + [el.task_id for el in updated])
+			log_changes(user, "task", removed, deleted = True)
+		return {"results": results}, 200
+
+
+# Columns of exported and imported records. Every folder is written as a
+# "folder" record before its "task" records, so empty folders survive.
+EXPORT_COLUMNS = ["record", "folder_name", "task_content", "task_deadline",
+	"task_priority"]
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+IMPORT_CHUNK = int(os.environ.get("IMPORT_CHUNK", 500))
+
+
+def export_records(user):
+	rows = Folder.select(Folder.folder_id, Folder.folder_name, Task.task_id,
+			Task.task_content, Task.task_deadline, Task.task_priority) \
+		.join(Task, JOIN.LEFT_OUTER) \
+		.where(Folder.user_id == user.user_id) \
+		.order_by(Folder.folder_id, Task.task_id) \
+		.dicts()
+	folder_id = None
+	for row in stream_rows(rows):
+		if row["folder_id"] != folder_id:
+			folder_id = row["folder_id"]
+			yield {"record": "folder", "folder_name": row["folder_name"]}
+		if row["task_id"] is not None:
+			yield {"record": "task", "folder_name": row["folder_name"],
+				**{key: row[key] for key in EXPORT_COLUMNS[2:]}}
+
+
+def read_records(file, file_format):
+	text = io.TextIOWrapper(file, encoding = "utf-8", newline = "")
+	if file_format == "csv":
+		yield from csv.DictReader(text)
+	else:
+		for line in text:
+			if line.strip():
+				yield json.loads(line)
+
+
+@api.route("/export")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "format", type = str, location = "form",
+		help = "'ndjson' (default) or 'csv'")
+)
+class Export(Resource):
+	@api.response(200, "One record per folder and per task")
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		file_format = request.form.get("format", "ndjson")
+		if file_format not in EXPORT_FORMATS:
+			return {"message": "Invalid request"}, 400
+		ensure_user(user)
+		
+		def generate():
+			# Rows are read through stream_rows() and sent in small chunks, so
+			# memory use does not grow with the number of tasks.
+			buffer = io.StringIO()
+			writer = csv.DictWriter(buffer, EXPORT_COLUMNS)
+			if file_format == "csv":
+				writer.writeheader()
+			for i, record in enumerate(export_records(user), 1):
+				if file_format == "csv":
+					writer.writerow(record)
+				else:
+					buffer.write(json.dumps(record) + "\n")
+				if i % 100 == 0:
+					yield buffer.getvalue()
+					buffer.seek(0)
+					buffer.truncate()
+			yield buffer.getvalue()
+		return Response(stream_with_context(generate()),
+			mimetype = EXPORT_FORMATS[file_format], headers = {
+				"Content-Disposition": f"attachment; filename=todolist.{file_format}"})
+
+
+@api.route("/import")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "format", type = str, location = "form",
+		help = "'ndjson' (default) or 'csv'")
+	.add_argument(name = "file", type = FileStorage, location = "files",
+		help = "Records in the format of /export")
+)
+class Import(Resource):
+	@api.response(200, "Success", import_model)
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		file_format = request.form.get("format", "ndjson")
+		if file_format not in EXPORT_FORMATS or "file" not in request.files:
+			return {"message": "Invalid request"}, 400
+		
+		# Tasks are added to the folders of the same name, which are created
+		# when missing. Every chunk of records is written in a transaction of
+		# its own, so an invalid record stops the import after the chunks
+		# before it.
+		folders = {el.folder_name: el.folder_id for el in folders_of(user)}
+		imported = {"folders": 0, "tasks": 0}
+		
+		def write(chunk):
+			with write_transaction():
+				# Folders created here are new, so only the existing ones change
+				bump_versions(user, [folders[el["folder_name"]] for el in chunk
+					if el["record"] == "task" and el["folder_name"] in folders])
+				new_folders, new_rows = [], []
+				for record in chunk:
+					if record["folder_name"] not in folders:
+						folder = Folder.create(user_id = user.user_id,
+							folder_name = record["folder_name"])
+						folders[folder.folder_name] = folder.folder_id
+						new_folders.append(folder.folder_id)
+					if record["record"] == "task":
+						new_rows.append({"folder_id": folders[record["folder_name"]],
+							**task_fields(record["task_content"], record["task_deadline"],
+								record["task_priority"])})
+				created = []
+				for rows in chunked(new_rows, 100):
+					created += [el.task_id for el in
+						Task.insert_many(rows).returning(Task.task_id).execute()]
+				log_changes(user, "folder", new_folders)
+				log_changes(user, "task", created)
+			imported["folders"] += len(new_folders)
+			imported["tasks"] += len(created)
+		
+		try:
+			for chunk in chunked(read_records(request.files["file"].stream, file_format),
+					IMPORT_CHUNK):
+				for record in chunk:
+					if not isinstance(record, dict) or \
+							record.get("record") not in ("folder", "task") or \
+							not isinstance(record.get("folder_name"), str) or \
+							(record["record"] == "task" and not all(
+								isinstance(record.get(key), str) for key in EXPORT_COLUMNS[2:])):
+						raise ValueError
+				write(chunk)
+		except (ValueError, UnicodeDecodeError):
+			return {"message": "Invalid request", **imported}, 400
+		return imported, 200
+
+
+@api.route("/subscribe")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+)
+class Subscribe(Resource):
+	@api.response(200, "A text/event-stream of folder, task and resync events")
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy", message_model)
+	@check_token
+	def post(self, user):
+		try:
+			subscription = broker.subscribe(user.username)
+		except BrokerBusy:
+			return busy_response()
+		
+		# Not wrapped in stream_with_context: the request is torn down and its
+		# database connection returned before the stream starts.
+		def generate():
+			try:
+				yield ": subscribed\n\n"
+				while True:
+					event = subscription.get(EVENTS_KEEPALIVE)
+					if event is None:
+						# Also how a closed connection is noticed
+						yield ": keep-alive\n\n"
+					else:
+						yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+			finally:
+				broker.unsubscribe(user.username, subscription)
+		return Response(generate(), mimetype = "text/event-stream",
+			headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@api.route("/sync")
+@api.expect(RequestParser()
+	.add_argument(name = "token", type = str, location = "form")
+	.add_argument(name = "since", type = int, location = "form",
+		help = "cursor of the previous sync; 0 or nothing for a full download")
+)
+class Sync(Resource):
+	@api.response(200, "Success", sync_model)
+	@api.response(400, "Invalid request", message_model)
+	@api.response(403, "Invalid token", message_model)
+	@api.response(410, "There is no such user", message_model)
+	@api.response(429, "Too many requests", message_model)
+	@api.response(503, "The server is busy, try again later", message_model)
+	@check_token
+	def post(self, user):
+		try:
+			since = int(request.form.get("since", 0))
+			if since < 0:
+				raise ValueError
+		except ValueError:
+			return {"message": "Invalid request"}, 400
+		
+		folders = Folder.select(Folder.folder_id, Folder.folder_name) \
+			.where(Folder.user_id == user.user_id)
+		tasks = Task.select(Task.task_id, Task.folder_id, Task.task_content,
+				Task.task_deadline, Task.task_priority) \
+			.join(Folder).where(Folder.user_id == user.user_id)
+		with db.atomic():
+			# Read in the same transaction as the changes: a reset without the
+			# user's rows would make the client wipe everything it has.
+			sync_floor = User.select(User.sync_floor) \
+				.where(User.user_id == user.user_id).scalar()
+			if sync_floor is None:
+				raise UserMoved(user.username)
+			cursor = change_log_cursor()
+			state = ChangeLogState.get_or_none()
+			# A full download replaces everything the client has, which is also
+			# the only option once the changes it missed have been compacted.
+			reset = since == 0 or since < (state.compacted_through if state else 0) or \
+				since < sync_floor or since > cursor
+			if reset:
+				changed_folders, changed_tasks = list(folders.dicts()), list(tasks.dicts())
+				deleted_folders, deleted_tasks = [], []
+			else:
+				latest = {}
+				for kind, object_id, deleted in ChangeLog \
+						.select(ChangeLog.kind, ChangeLog.object_id, ChangeLog.deleted) \
+						.where((ChangeLog.user_id == user.user_id) &
+							(ChangeLog.change_id > since) & (ChangeLog.change_id <= cursor)) \
+						.order_by(ChangeLog.change_id).tuples():
+					latest[(kind, object_id)] = deleted
+				folder_ids = [el[1] for el, deleted in latest.items()
+					if el[0] == "folder" and not deleted]
+				task_ids = [el[1] for el, deleted in latest.items()
+					if el[0] == "task" and not deleted]
+				changed_folders, changed_tasks = [], []
+				for ids in chunked(folder_ids, 500):
+					changed_folders.extend(folders.where(Folder.folder_id.in_(ids)).dicts())
+				for ids in chunked(task_ids, 500):
+					changed_tasks.extend(tasks.where(Task.task_id.in_(ids)).dicts())
+				# Changed rows that no longer exist were deleted later on,
+				# possibly together with their folder.
+				found_folders = {el["folder_id"] for el in changed_folders}
+				found_tasks = {el["task_id"] for el in changed_tasks}
+				deleted_folders = [el[1] for el in latest if el[0] == "folder" and
+					el[1] not in found_folders]
+				deleted_tasks = [el[1] for el in latest if el[0] == "task" and
+					el[1] not in found_tasks]
+		
+		return {
+			"cursor": cursor,
+			"reset": reset,
+			"folders": changed_folders,
+			"tasks": [{"folder_id": el["folder_id"], **task_to_dict(el)}
+				for el in changed_tasks],
+			"deleted_folders": deleted_folders,
+			"deleted_tasks": deleted_tasks
+		}, 200
+
+
+@app.cli.command("backup")
+@click.argument("path")
+@click.option("--pages", default = -1, help = "Pages copied per step, "
+	"-1 for a single step")
+def backup(path, pages):
+	"""Copy the SQLite database to PATH while the service keeps running.
+	With several shards, shard N is copied to PATH.N, and a separate
+	DIRECTORY_URL database to PATH.directory."""
+	for index in range(len(shards)):
+		shard_path = f"{path}.{index}" if len(shards) > 1 else path
+		with use_shard(index):
+			backup_database(shard_path, pages)
+		print(f"Database copied to {shard_path}")
+	if directory_db not in shards:
+		backup_database(f"{path}.directory", pages, database = directory_db)
+		print(f"Shard directory copied to {path}.directory")
+
+
+@app.cli.command("rebalance")
+@click.option("--dry-run", is_flag = True, help = "Only list the moves")
+def rebalance(dry_run):
+	"""Move users to the shards the consistent hash ring assigns them, after
+	shards were appended to SHARD_URLS. Workers notice a moved user on
+	their next request of that user, which answers 503 to be retried."""
+	for username, source, target in rebalance_shards(dry_run):
+		print(f"{username}: shard {source} -> {target}")
+		if not dry_run:
+			# Ids changed; only reaches the workers through EVENTS_URL=redis://
+			broker.publish(username, {"type": "resync"})
+
+
+@app.cli.command("compact-changes")
+def compact_changes():
+	"""Keep only the newest CHANGE_LOG_LIMIT entries of the sync change log."""
+	removed = compact_change_log(int(os.environ.get("CHANGE_LOG_LIMIT", 100000)))
+	print(f"{removed} changes removed")
 
 
 if __name__ == "__main__":	
@@ -0,0 +1,100 @@
+import os, shutil, sys, tempfile, uuid
+import pytest
+
+# Database.py and Hashing.py read their settings at import time, so the
+# service is pointed at scratch databases before it is imported: two SQLite
+# shards by default, or the comma-separated TEST_SHARD_URLS, e.g. empty
+# PostgreSQL databases to run the suite against the production backend.
+# TEST_POSTGRES=1 spawns a throwaway PostgreSQL server with two such
+# databases instead (needs pgserver and psycopg2).
+DIRECTORY = tempfile.mkdtemp(prefix = "todolist-test-")
+postgres = None
+if os.environ.get("TEST_POSTGRES") and not os.environ.get("TEST_SHARD_URLS"):
+	import pgserver
+	postgres = pgserver.get_server(os.path.join(DIRECTORY, "postgres"),
+		cleanup_mode = "stop")
+	for index in range(2):
+		postgres.psql(f"CREATE DATABASE shard{index};")
+	SHARD_URLS = ",".join(postgres.get_uri(f"shard{index}") for index in range(2))
+else:
+	SHARD_URLS = os.environ.get("TEST_SHARD_URLS") or ",".join(
+		f"sqlite:///{os.path.join(DIRECTORY, f'shard{index}.db')}" for index in range(2))
+os.environ.update({
+	"SHARD_URLS": SHARD_URLS,
+	"DATABASE_URL": SHARD_URLS.split(",")[0],
+	"BCRYPT_ROUNDS": "4",
+	"RATE_LIMITS_USER": "",
+	"RATE_LIMITS_IP": "",
+	"EVENTS_KEEPALIVE": "0.1",
+	"HASHING_LOCK_DIR": os.path.join(DIRECTORY, "hashing"),
+	"LOG_FILE": os.path.join(DIRECTORY, "ToDoList.log")
+})
+for name in ("DIRECTORY_URL", "LISTING_CACHE_URL", "EVENTS_URL", "RATE_LIMIT_URL",
+		"PROFILE_SLOWEST"):
+	os.environ.pop(name, None)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Server import app
+
+
+def pytest_sessionfinish(session):
+	from Database import close_connections
+	close_connections()
+	if postgres:
+		postgres.cleanup()
+	shutil.rmtree(DIRECTORY, ignore_errors = True)
+
+
+class Account:
+	"""A registered user, posting to routes with their token."""
+
+	def __init__(self, client, username, password, token):
+		self.client = client
+		self.username = username
+		self.password = password
+		self.token = token
+
+	def post(self, route, headers = None, **form):
+		return self.client.post("/" + route, data = {"token": self.token, **form},
+			headers = headers)
+
+	def folders(self):
+		return self.post("get_folders").get_json()
+
+	def tasks(self, **form):
+		return self.post("get_tasks", **form).get_json()["task_list"]
+
+
+@pytest.fixture
+def client():
+	return app.test_client()
+
+
+@pytest.fixture
+def register(client):
+	"""Registers users with unique names; each starts with a Default folder."""
+	def register(username = None, password = "password"):
+		username = username or f"user-{uuid.uuid4().hex}"
+		response = client.post("/registration",
+			data = {"username": username, "password": password})
+		assert response.status_code == 200, response.get_json()
+		return Account(client, username, password, response.get_json()["token"])
+	return register
+
+
+@pytest.fixture
+def account(register):
+	return register()
+
+
+@pytest.fixture
+def neighbours(register):
+	"""Two users of the same shard, where their ids can be mistaken for
+	each other's."""
+	from Database import locate_user
+	alice = register()
+	while True:
+		bob = register()
+		if locate_user(bob.username) == locate_user(alice.username):
+			return alice, bob
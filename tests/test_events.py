@@ -0,0 +1,64 @@
+import io, json
+import Server
+from Events import Subscription
+
+
+def read_event(stream):
+	"""The next event of a /subscribe stream, skipping comments."""
+	for chunk in stream:
+		chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+		if not chunk.startswith(":"):
+			name, data = chunk.strip().split("\n")
+			return name.split(": ", 1)[1], json.loads(data.split(": ", 1)[1])
+
+
+def test_subscriber_sees_changes(account):
+	response = account.client.post("/subscribe", data = {"token": account.token},
+		buffered = False)
+	assert response.status_code == 200
+	stream = iter(response.response)
+	try:
+		assert next(stream).startswith(b": subscribed")
+		account.post("create_folder", folder_name = "Work")
+		kind, event = read_event(stream)
+		assert kind == "folder"
+		assert event["ids"] == account.folders()["ids"][1:]
+		assert not event["deleted"]
+	finally:
+		response.close()
+	assert Server.broker.stats()["subscriptions"] == 0
+
+
+def test_failed_writes_are_not_published(account):
+	subscription = Server.broker.subscribe(account.username)
+	try:
+		assert account.post("create_folder", folder_name = "Default").status_code == 409
+		assert account.post("delete_folder", folder_number = 3).status_code == 404
+		assert subscription.get(0.1) is None
+	finally:
+		Server.broker.unsubscribe(account.username, subscription)
+
+
+def test_failed_import_publishes_committed_chunks(account, monkeypatch):
+	monkeypatch.setattr(Server, "IMPORT_CHUNK", 1)
+	records = [{"record": "folder", "folder_name": "A"}, {"record": "task"}]
+	data = "\n".join(json.dumps(el) for el in records).encode()
+	subscription = Server.broker.subscribe(account.username)
+	try:
+		response = account.post("import", format = "ndjson",
+			file = (io.BytesIO(data), "todolist.ndjson"))
+		assert response.status_code == 400
+		event = subscription.get(0.1)
+		assert event["type"] == "folder"
+		assert event["ids"] == account.folders()["ids"][1:]
+		assert subscription.get(0.1) is None
+	finally:
+		Server.broker.unsubscribe(account.username, subscription)
+
+
+def test_slow_subscriber_resyncs():
+	subscription = Subscription(2)
+	for number in range(3):
+		subscription.put({"type": "task", "ids": [number]})
+	assert subscription.get(0) == {"type": "resync"}
+	assert subscription.get(0) is None
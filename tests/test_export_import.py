@@ -0,0 +1,90 @@
+import io, json, sqlite3
+import pytest
+import Server
+from peewee import SqliteDatabase
+from Database import db, shards, use_shard, locate_user, open_database, ShardDirectory
+
+
+def export(account, file_format = "ndjson"):
+	response = account.post("export", format = file_format)
+	assert response.status_code == 200
+	return response.get_data()
+
+
+def upload(account, data, file_format = "ndjson"):
+	return account.post("import", format = file_format,
+		file = (io.BytesIO(data), f"todolist.{file_format}"))
+
+
+def test_round_trip(register):
+	alice = register()
+	alice.post("create_folder", folder_name = "Empty")
+	alice.post("new_task", folder_number = 0, task_content = "milk",
+		task_deadline = "2030-01-01", task_priority = "high")
+
+	for file_format in ("ndjson", "csv"):
+		bob = register()
+		response = upload(bob, export(alice, file_format), file_format)
+		assert response.status_code == 200
+		# Default exists already
+		assert response.get_json() == {"folders": 1, "tasks": 1}
+		assert bob.folders()["list"] == ["Default", "Empty"]
+		assert bob.tasks(folder_number = 0) == [{**alice.tasks(folder_number = 0)[0],
+			"task_id": bob.tasks(folder_number = 0)[0]["task_id"]}]
+
+
+def test_invalid_record(account, monkeypatch):
+	monkeypatch.setattr("Server.IMPORT_CHUNK", 2)
+	records = [{"record": "folder", "folder_name": "A"},
+		{"record": "task", "folder_name": "A", "task_content": "1",
+			"task_deadline": "", "task_priority": "1"},
+		{"record": "task", "folder_name": "B"}]
+	response = upload(account, "\n".join(json.dumps(el) for el in records).encode())
+	assert response.status_code == 400
+	# The chunk before the invalid record stays imported
+	assert response.get_json()["tasks"] == 1
+	assert account.folders()["list"] == ["Default", "A"]
+	assert upload(account, b"\xff").status_code == 400
+	assert account.post("import").status_code == 400
+
+
+@pytest.mark.skipif(isinstance(shards[0], SqliteDatabase), reason = "needs PostgreSQL")
+def test_export_reads_through_a_server_side_cursor(account):
+	lines = "\n".join(json.dumps({"record": "task", "folder_name": "Default",
+		"task_content": str(number), "task_deadline": "", "task_priority": "1"})
+		for number in range(1000))
+	assert upload(account, lines.encode()).status_code == 200
+
+	for route, form in (("export", {}), ("get_tasks", {"folder_number": 0,
+			"format": "ndjson"})):
+		response = account.client.post("/" + route,
+			data = {"token": account.token, **form}, buffered = False)
+		stream = iter(response.response)
+		try:
+			next(stream)
+			# The request's connection is this thread's
+			with use_shard(locate_user(account.username)):
+				assert db.execute_sql("SELECT count(*) FROM pg_cursors") \
+					.fetchone()[0] == 1, route
+			assert len(b"".join([next(stream), *stream]).splitlines()) > 900
+		finally:
+			response.close()
+
+
+@pytest.mark.skipif(not isinstance(shards[0], SqliteDatabase), reason = "needs SQLite")
+def test_backup_with_separate_directory(account, tmp_path, monkeypatch):
+	directory = open_database(f"sqlite:///{tmp_path / 'directory.db'}")
+	with directory.bind_ctx([ShardDirectory]):
+		directory.create_tables([ShardDirectory])
+		ShardDirectory.create(username = account.username, shard = 0)
+	monkeypatch.setattr(Server, "directory_db", directory)
+
+	path = str(tmp_path / "backup.db")
+	result = Server.app.test_cli_runner().invoke(args = ["backup", path])
+	assert result.exit_code == 0, result.output
+	connection = sqlite3.connect(f"{path}.directory")
+	try:
+		assert connection.execute('SELECT username FROM "ShardDirectory"') \
+			.fetchall() == [(account.username,)]
+	finally:
+		connection.close()
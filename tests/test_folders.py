@@ -0,0 +1,109 @@
+from peewee import OperationalError
+import Server
+from Database import query_listeners
+
+
+def test_registration_and_login(client, account):
+	response = client.post("/registration",
+		data = {"username": account.username, "password": "other"})
+	assert response.status_code == 401
+
+	response = client.post("/login",
+		data = {"username": account.username, "password": account.password})
+	assert response.status_code == 200
+	assert response.get_json()["token"]
+
+	response = client.post("/login",
+		data = {"username": account.username, "password": "wrong"})
+	assert response.status_code == 401
+	assert client.post("/login", data = {"username": account.username}).status_code == 400
+
+
+def test_invalid_token(client):
+	assert client.post("/get_folders", data = {"token": "garbage"}).status_code == 403
+	assert client.post("/get_folders").status_code == 400
+
+
+def test_create_rename_delete(account):
+	assert account.folders()["list"] == ["Default"]
+
+	assert account.post("create_folder", folder_name = "Work").status_code == 200
+	assert account.post("create_folder", folder_name = "Work").status_code == 409
+	assert account.folders()["list"] == ["Default", "Work"]
+
+	response = account.post("rename_folder", folder_number = 1, new_name = "Job")
+	assert response.status_code == 200
+	assert account.folders()["list"] == ["Default", "Job"]
+
+	folder_id = account.folders()["ids"][1]
+	assert account.post("delete_folder", folder_id = folder_id).status_code == 200
+	assert account.folders()["list"] == ["Default"]
+
+
+def test_missing_folder(account):
+	assert account.post("delete_folder", folder_number = 5).status_code == 404
+	assert account.post("delete_folder", folder_number = -1).status_code == 404
+	assert account.post("delete_folder", folder_number = "x").status_code == 404
+	assert account.post("rename_folder", folder_id = 10 ** 9, new_name = "x") \
+		.status_code == 404
+	assert account.post("delete_folder").status_code == 400
+
+
+def test_folders_of_other_users(neighbours):
+	alice, bob = neighbours
+	folder_id = alice.folders()["ids"][0]
+	assert bob.post("delete_folder", folder_id = folder_id).status_code == 404
+	assert bob.post("get_tasks", folder_id = folder_id).status_code == 404
+	assert alice.folders()["list"] == ["Default"]
+
+
+def test_overview(account):
+	account.post("create_folder", folder_name = "Work")
+	for day, priority in ((3, "low"), (1, "high"), (2, "urgent"), (1, "low")):
+		account.post("new_task", folder_number = 1, task_content = f"{day} {priority}",
+			task_deadline = f"2030-01-0{day}", task_priority = priority)
+
+	folders = account.post("overview", top = 2).get_json()["folders"]
+	assert [el["task_count"] for el in folders] == [0, 4]
+	assert [el["task_content"] for el in folders[1]["top_tasks"]] == ["1 high", "1 low"]
+	assert account.post("overview", top = 21).status_code == 400
+
+
+def test_overview_statements_do_not_grow_with_folders(register):
+	def statements(folder_count):
+		account = register()
+		for number in range(1, folder_count):
+			account.post("create_folder", folder_name = f"Folder {number}")
+		for number in range(folder_count):
+			account.post("new_task", folder_number = number, task_content = "task",
+				task_deadline = "", task_priority = "1")
+
+		executed = []
+		listener = lambda sql, seconds: executed.append(sql)
+		query_listeners.append(listener)
+		try:
+			folders = account.post("overview", top = 3).get_json()["folders"]
+		finally:
+			query_listeners.remove(listener)
+		assert [el["task_count"] for el in folders] == [1] * folder_count
+		return len(executed)
+
+	assert statements(2) == statements(20)
+
+
+def test_only_busy_databases_answer_503(account, monkeypatch):
+	class LockNotAvailable(Exception):
+		pgcode = "55P03"
+
+	def fail_with(error):
+		def folders_of(user):
+			raise OperationalError(error, *error.args)
+		monkeypatch.setattr(Server, "folders_of", folders_of)
+		# Failed listings are not cached, so every call gets that far
+		return account.post("get_folders")
+
+	for error in (Exception("database is locked"), LockNotAvailable("canceling statement")):
+		response = fail_with(error)
+		assert response.status_code == 503
+		assert response.headers["Retry-After"] == "1"
+	assert fail_with(Exception("row value misused")).status_code == 500
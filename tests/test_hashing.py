@@ -0,0 +1,47 @@
+import subprocess, sys
+import pytest
+import Server
+from Hashing import HashingPool, HashingBusy, SlotFiles
+
+
+def hold_slots(directory, count):
+	"""Takes every slot from another process, like other gunicorn workers
+	hashing at the same time."""
+	holder = subprocess.Popen([sys.executable, "-c",
+		"import sys; from Hashing import SlotFiles; "
+		f"slots = SlotFiles({directory!r}, {count}); "
+		f"held = [slots.acquire() for _ in range({count})]; "
+		"print(None not in held, flush = True); sys.stdin.read()"],
+		cwd = Server.app.root_path, stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+		text = True)
+	assert holder.stdout.readline().strip() == "True"
+	return holder
+
+
+def release(holder):
+	holder.stdin.close()
+	holder.wait()
+
+
+def test_slots_are_shared_between_processes(tmp_path):
+	pool = HashingPool(1, 2, rounds = 4, lock_dir = str(tmp_path))
+	holder = hold_slots(str(tmp_path), 2)
+	try:
+		with pytest.raises(HashingBusy):
+			pool.hash("password")
+	finally:
+		release(holder)
+	assert pool.check("password", pool.hash("password"))
+
+
+def test_logins_beyond_the_limit_are_refused(client, account, tmp_path, monkeypatch):
+	monkeypatch.setattr(Server.hashing_pool, "_slots", SlotFiles(str(tmp_path), 1))
+	form = {"username": account.username, "password": account.password}
+	holder = hold_slots(str(tmp_path), 1)
+	try:
+		response = client.post("/login", data = form)
+		assert response.status_code == 503
+		assert response.headers["Retry-After"] == "1"
+	finally:
+		release(holder)
+	assert client.post("/login", data = form).status_code == 200
@@ -0,0 +1,84 @@
+import Server
+from Database import User, Folder, Task, use_shard, locate_user
+
+
+def test_not_modified_until_changed(account):
+	response = account.post("get_tasks", folder_number = 0)
+	etag = response.headers["ETag"]
+	assert account.post("get_tasks", folder_number = 0,
+		headers = {"If-None-Match": etag}).status_code == 304
+
+	account.post("new_task", folder_number = 0, task_content = "new",
+		task_deadline = "", task_priority = "1")
+	response = account.post("get_tasks", folder_number = 0,
+		headers = {"If-None-Match": etag})
+	assert response.status_code == 200
+	assert response.headers["ETag"] != etag
+	assert [el["task_content"] for el in response.get_json()["task_list"]] == ["new"]
+
+
+def test_cached_listing_follows_writes(account):
+	for name in ("One", "Two"):
+		account.folders()
+		account.post("create_folder", folder_name = name)
+	assert account.folders()["list"] == ["Default", "One", "Two"]
+
+	hits = Server.listing_cache.stats()["hits"]
+	assert account.folders()["list"] == ["Default", "One", "Two"]
+	assert Server.listing_cache.stats()["hits"] == hits + 1
+
+
+def test_representations_do_not_share_etags(account):
+	plain = account.post("get_folders").headers["ETag"]
+	columnar = account.post("get_folders",
+		headers = {"Accept": Server.COLUMNAR_MEDIATYPE})
+	assert columnar.headers["ETag"] != plain
+	assert columnar.get_json()["list"] == ["Default"]
+
+
+def test_compression(account):
+	for number in range(100):
+		account.post("new_task", folder_number = 0, task_content = f"task {number}",
+			task_deadline = "", task_priority = "1")
+	response = account.post("get_tasks", folder_number = 0,
+		headers = {"Accept-Encoding": "gzip"})
+	assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_deleted_folder_ids_are_not_reused(account):
+	account.post("create_folder", folder_name = "Old")
+	old_id = account.folders()["ids"][1]
+	account.post("new_task", folder_id = old_id, task_content = "old",
+		task_deadline = "", task_priority = "1")
+	etag = account.post("get_tasks", folder_id = old_id).headers["ETag"]
+
+	account.post("delete_folder", folder_id = old_id)
+	account.post("create_folder", folder_name = "New")
+	new_id = account.folders()["ids"][1]
+	account.post("new_task", folder_id = new_id, task_content = "new",
+		task_deadline = "", task_priority = "1")
+	assert new_id != old_id
+	response = account.post("get_tasks", folder_id = old_id,
+		headers = {"If-None-Match": etag})
+	assert response.status_code == 404
+
+
+def test_listings_of_other_users(neighbours):
+	alice, bob = neighbours
+	alice.post("create_folder", folder_name = "Alice's")
+	folder_id = alice.folders()["ids"][1]
+	alice.post("new_task", folder_id = folder_id, task_content = "Alice's",
+		task_deadline = "", task_priority = "1")
+	etag = alice.post("get_tasks", folder_id = folder_id).headers["ETag"]
+
+	# The same folder id and version for Bob, as SQLite handed out before
+	# ids were AUTOINCREMENT
+	with use_shard(locate_user(bob.username)):
+		Task.delete().where(Task.folder_id == folder_id).execute()
+		Folder.update(user_id = User.get(User.username == bob.username).user_id) \
+			.where(Folder.folder_id == folder_id).execute()
+	response = bob.post("get_tasks", folder_id = folder_id)
+	assert response.headers["ETag"] != etag
+	assert response.get_json()["task_list"] == []
+	assert bob.post("get_tasks", folder_id = folder_id,
+		headers = {"If-None-Match": etag}).status_code == 200
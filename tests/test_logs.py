@@ -0,0 +1,22 @@
+import os
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
+from Logs import log_path, file_handler
+
+
+def test_rotated_files_are_per_process(tmp_path, monkeypatch):
+	monkeypatch.delenv("LOG_FILE")
+	monkeypatch.delenv("LOG_ROTATE", raising = False)
+	assert log_path() == f"ToDoList.{os.getpid()}.log"
+	handler = file_handler(str(tmp_path / "size.log"))
+	assert isinstance(handler, RotatingFileHandler)
+	handler.close()
+
+	# One file for every worker, rotated outside the service
+	monkeypatch.setenv("LOG_ROTATE", "external")
+	assert log_path() == "ToDoList.log"
+	handler = file_handler(str(tmp_path / "shared.log"))
+	assert isinstance(handler, WatchedFileHandler)
+	handler.close()
+
+	monkeypatch.setenv("LOG_FILE", str(tmp_path / "worker-{pid}.log"))
+	assert log_path() == str(tmp_path / f"worker-{os.getpid()}.log")
@@ -0,0 +1,110 @@
+import os, sqlite3, subprocess, sys, uuid
+from peewee import SqliteDatabase, Model, AutoField, TextField, BlobField, ForeignKeyField
+import conftest
+from conftest import ROOT
+
+
+def create_baseline(path):
+	"""The schema the service started with, before any migration."""
+	database = SqliteDatabase(path, pragmas = {"foreign_keys": 1})
+
+	class User(Model):
+		user_id = AutoField(column_name = "user_id")
+		username = TextField(column_name = "username", unique = True)
+		password = BlobField(column_name = "password")
+
+		class Meta:
+			table_name = "Users"
+
+	class Folder(Model):
+		folder_id = AutoField(column_name = "folder_id")
+		user_id = ForeignKeyField(User)
+		folder_name = TextField(column_name = "folder_name")
+
+		class Meta:
+			table_name = "Folders"
+
+	class Task(Model):
+		task_id = AutoField(column_name = "task_id")
+		folder_id = ForeignKeyField(Folder)
+		task_content = TextField(column_name = "task_content")
+		task_deadline = TextField(column_name = "task_deadline")
+		task_priority = TextField(column_name = "task_priority")
+
+		class Meta:
+			table_name = "Tasks"
+
+	with database.bind_ctx([User, Folder, Task]):
+		database.create_tables([User, Folder, Task])
+		user = User.create(username = "old", password = b"hash")
+		folder = Folder.create(user_id = user, folder_name = "Default")
+		Task.create(folder_id = folder, task_content = "buy milk",
+			task_deadline = "31.05.2024", task_priority = "high")
+		Task.create(folder_id = folder, task_content = "call mom",
+			task_deadline = "whenever", task_priority = "7")
+	database.close()
+
+
+def upgrade_command(url):
+	environment = {key: value for key, value in os.environ.items()
+		if key not in ("SHARD_URLS", "DIRECTORY_URL")}
+	environment["DATABASE_URL"] = url
+	return dict(args = [sys.executable, "-c",
+		"import Database; print(len(Database.MIGRATIONS))"],
+		cwd = ROOT, env = environment)
+
+
+def upgrade(path):
+	subprocess.run(**upgrade_command(f"sqlite:///{path}"), check = True,
+		capture_output = True)
+
+
+def test_upgrade_from_baseline(tmp_path):
+	path = str(tmp_path / "baseline.db")
+	create_baseline(path)
+	upgrade(path)
+	# Upgrading again is a no-op
+	upgrade(path)
+
+	import Database
+	connection = sqlite3.connect(path)
+	try:
+		assert connection.execute('SELECT version FROM "SchemaVersion"').fetchall() == \
+			[(len(Database.MIGRATIONS),)]
+		rows = connection.execute('SELECT task_content, deadline_at, priority_level '
+			'FROM "Tasks" ORDER BY task_id').fetchall()
+		assert rows == [("buy milk", "2024-05-31 00:00:00", 3),
+			("call mom", "9999-12-31 00:00:00", 7)]
+		assert connection.execute('SELECT username, version, sync_floor FROM "Users"') \
+			.fetchall() == [("old", 0, 0)]
+		indexes = {el[0] for el in connection.execute(
+			"SELECT name FROM sqlite_master WHERE type = 'index'")}
+		assert {"folder_user_id_folder_name",
+			"task_folder_id_deadline_at_priority_level"} <= indexes
+		if Database.SEARCH_ENABLED:
+			assert connection.execute('SELECT rowid FROM "TaskIndex" '
+				"WHERE \"TaskIndex\" MATCH 'milk'").fetchall() == [(1,)]
+		assert connection.execute("PRAGMA foreign_key_check").fetchall() == []
+		for table in ("Users", "Folders", "ChangeLog"):
+			sql = connection.execute("SELECT sql FROM sqlite_master "
+				"WHERE name = ?", (table,)).fetchone()[0]
+			assert "AUTOINCREMENT" in sql
+		assert connection.execute('SELECT folder_name FROM "Folders" '
+			'JOIN "Users" USING (user_id)').fetchall() == [("Default",)]
+	finally:
+		connection.close()
+
+
+def test_workers_upgrading_at_once(tmp_path):
+	# Every worker upgrades the schema when it imports Database
+	if conftest.postgres:
+		name = f"upgrade_{uuid.uuid4().hex}"
+		conftest.postgres.psql(f"CREATE DATABASE {name};")
+		url = conftest.postgres.get_uri(name)
+	else:
+		url = f"sqlite:///{tmp_path / 'new.db'}"
+	workers = [subprocess.Popen(**upgrade_command(url), stdout = subprocess.PIPE,
+		stderr = subprocess.PIPE) for _ in range(4)]
+	for worker in workers:
+		_, error = worker.communicate()
+		assert worker.returncode == 0, error.decode()
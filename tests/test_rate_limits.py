@@ -0,0 +1,51 @@
+import Server
+from RateLimit import RateLimiter, parse_limits
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+
+def test_parse_limits():
+	assert parse_limits("login=10/60, /registration=5/60:2,*=50") == {
+		"login": (10 / 60, 10.0),
+		"registration": (5 / 60, 2.0),
+		"*": (50.0, 50.0)
+	}
+	assert parse_limits("") == {}
+
+
+def test_token_bucket():
+	limiter = RateLimiter()
+	assert [limiter.acquire("key", 1, 2) for _ in range(2)] == [0, 0]
+	assert 0 < limiter.acquire("key", 1, 2) <= 1
+	assert limiter.acquire("other", 1, 2) == 0
+
+
+def test_limits_per_user_and_address(client, register, monkeypatch):
+	monkeypatch.setattr(Server, "rate_limiter", RateLimiter())
+	alice, bob = register(), register()
+	monkeypatch.setattr(Server, "USER_LIMITS", parse_limits("get_folders=2/60"))
+	assert [alice.post("get_folders").status_code for _ in range(3)] == [200, 200, 429]
+	assert bob.post("get_folders").status_code == 200
+	assert alice.post("get_folders").headers["Retry-After"] == "30"
+
+	monkeypatch.setattr(Server, "IP_LIMITS", parse_limits("login=1/60"))
+	form = {"username": alice.username, "password": alice.password}
+	assert [client.post("/login", data = form).status_code for _ in range(2)] == [200, 429]
+
+
+def test_forwarded_addresses(client, account, monkeypatch):
+	monkeypatch.setattr(Server, "rate_limiter", RateLimiter())
+	monkeypatch.setattr(Server, "IP_LIMITS", parse_limits("login=1/60"))
+	form = {"username": account.username, "password": account.password}
+
+	def login(forwarded_for):
+		return client.post("/login", data = form,
+			headers = {"X-Forwarded-For": forwarded_for}).status_code
+
+	# Without trusted proxies the header is ignored
+	assert [login("10.0.0.1"), login("10.0.0.2")] == [200, 429]
+
+	monkeypatch.setattr(Server.app, "wsgi_app", ProxyFix(Server.app.wsgi_app, x_for = 1))
+	assert login("10.0.0.3") == 200
+	# Entries left of the one the proxy added are the client's own
+	assert login("1.1.1.1, 10.0.0.3") == 429
+	assert login("10.0.0.4") == 200
@@ -0,0 +1,82 @@
+import pytest
+import Database
+from Database import shards, use_shard, locate_user, move_user, User, Folder
+
+pytestmark = pytest.mark.skipif(len(shards) < 2, reason = "needs several shards")
+
+
+def test_users_spread_over_shards(register):
+	accounts = [register() for _ in range(20)]
+	assert {locate_user(el.username) for el in accounts} == set(range(len(shards)))
+	for el in accounts:
+		with use_shard(locate_user(el.username)):
+			assert User.get_or_none(User.username == el.username)
+		el.post("create_folder", folder_name = el.username)
+		assert el.folders()["list"] == ["Default", el.username]
+
+
+def test_move_user(account):
+	account.post("new_task", folder_number = 0, task_content = "milk",
+		task_deadline = "", task_priority = "1")
+	cursor = account.post("sync").get_json()["cursor"]
+	source = locate_user(account.username)
+	target = (source + 1) % len(shards)
+
+	move_user(account.username, source, target)
+	assert locate_user(account.username) == target
+	with use_shard(source):
+		assert not User.get_or_none(User.username == account.username)
+	assert account.folders()["list"] == ["Default"]
+	assert [el["task_content"] for el in account.tasks(folder_number = 0)] == ["milk"]
+	# Ids changed, so clients download everything again
+	assert account.post("sync", since = cursor).get_json()["reset"]
+
+
+def test_moving_out_keeps_cursors(neighbours):
+	alice, bob = neighbours
+	before = alice.post("sync").get_json()["cursor"]
+	# Bob's changes are the newest of the shard, and leave with him
+	bob.post("create_folder", folder_name = "Bob's")
+	after = alice.post("sync").get_json()["cursor"]
+	source = locate_user(bob.username)
+	move_user(bob.username, source, (source + 1) % len(shards))
+	for cursor in (before, after):
+		changes = alice.post("sync", since = cursor).get_json()
+		assert not changes["reset"]
+		assert changes["cursor"] >= after
+
+
+def move_elsewhere(account, monkeypatch):
+	"""Moves the user as another worker would, leaving this worker's user
+	cache as it was."""
+	account.folders()
+	source = locate_user(account.username)
+	monkeypatch.setattr(Database, "user_listeners", [])
+	move_user(account.username, source, (source + 1) % len(shards))
+	monkeypatch.undo()
+	return source
+
+
+def test_writes_after_a_move_by_another_worker(account, monkeypatch):
+	source = move_elsewhere(account, monkeypatch)
+	response = account.post("create_folder", folder_name = account.username)
+	assert response.status_code == 503
+	assert response.headers["Retry-After"] == "1"
+	with use_shard(source):
+		assert not Folder.select().where(Folder.folder_name == account.username).exists()
+	assert account.post("create_folder", folder_name = account.username).status_code == 200
+	assert account.folders()["list"] == ["Default", account.username]
+
+
+def test_reads_after_a_move_by_another_worker(account, monkeypatch):
+	account.post("new_task", folder_number = 0, task_content = "milk",
+		task_deadline = "2030-01-01", task_priority = "1")
+	# Rather than an empty account, which a sync client would apply
+	for route, form in (("get_folders", {}), ("overview", {}), ("sync", {"since": 0}),
+			("export", {}), ("get_tasks", {"folder_id": 10 ** 9}),
+			("upcoming_tasks", {"deadline_from": "2040-01-01"}),
+			("search_tasks", {"query": "bread"})):
+		move_elsewhere(account, monkeypatch)
+		assert account.post(route, **form).status_code == 503, route
+	sync = account.post("sync").get_json()
+	assert [el["task_content"] for el in sync["tasks"]] == ["milk"]
@@ -0,0 +1,58 @@
+from Database import shards, use_shard, compact_change_log
+
+
+def test_full_then_incremental(account):
+	account.post("new_task", folder_number = 0, task_content = "kept",
+		task_deadline = "", task_priority = "1")
+	account.post("new_task", folder_number = 0, task_content = "removed",
+		task_deadline = "", task_priority = "1")
+	full = account.post("sync").get_json()
+	assert full["reset"]
+	assert [el["folder_name"] for el in full["folders"]] == ["Default"]
+	assert sorted(el["task_content"] for el in full["tasks"]) == ["kept", "removed"]
+
+	removed = [el for el in full["tasks"] if el["task_content"] == "removed"][0]
+	account.post("remove_task", task_id = removed["task_id"])
+	account.post("create_folder", folder_name = "Work")
+	changes = account.post("sync", since = full["cursor"]).get_json()
+	assert not changes["reset"]
+	assert [el["folder_name"] for el in changes["folders"]] == ["Work"]
+	assert changes["tasks"] == []
+	assert changes["deleted_tasks"] == [removed["task_id"]]
+
+	unchanged = account.post("sync", since = changes["cursor"]).get_json()
+	assert not unchanged["reset"]
+	assert unchanged["folders"] == unchanged["tasks"] == []
+
+
+def test_changes_of_other_users(register):
+	alice, bob = register(), register()
+	cursor = alice.post("sync").get_json()["cursor"]
+	bob.post("create_folder", folder_name = "Bob's")
+	changes = alice.post("sync", since = cursor).get_json()
+	assert not changes["reset"]
+	assert changes["folders"] == []
+
+
+def test_invalid_cursor(account):
+	assert account.post("sync", since = -1).status_code == 400
+	assert account.post("sync", since = "x").status_code == 400
+	assert account.post("sync", since = 10 ** 12).get_json()["reset"]
+
+
+def test_compaction_keeps_cursors(account):
+	old = account.post("sync").get_json()["cursor"]
+	account.post("create_folder", folder_name = "Before")
+	cursor = account.post("sync", since = old).get_json()["cursor"]
+	for index in range(len(shards)):
+		with use_shard(index):
+			compact_change_log(0)
+
+	# Only cursors older than the removed changes have to start over
+	assert account.post("sync", since = old).get_json()["reset"]
+	assert not account.post("sync", since = cursor).get_json()["reset"]
+	account.post("create_folder", folder_name = "After")
+	changes = account.post("sync", since = cursor).get_json()
+	assert not changes["reset"]
+	assert changes["cursor"] > cursor
+	assert [el["folder_name"] for el in changes["folders"]] == ["After"]
@@ -0,0 +1,133 @@
+import base64, json
+import Server
+from Database import parse_priority
+
+
+def add_tasks(account, *tasks, folder_number = 0):
+	for content, deadline, priority in tasks:
+		response = account.post("new_task", folder_number = folder_number,
+			task_content = content, task_deadline = deadline, task_priority = priority)
+		assert response.status_code == 200
+
+
+def test_new_update_remove(account):
+	add_tasks(account, ("milk", "2030-01-01", "2"))
+	task = account.tasks(folder_number = 0)[0]
+	assert task["task_content"] == "milk"
+
+	account.post("create_folder", folder_name = "Shop")
+	response = account.post("update_task", task_id = task["task_id"],
+		new_folder_number = 1, new_content = "bread", new_deadline = "",
+		new_priority = "high")
+	assert response.status_code == 200
+	assert account.tasks(folder_number = 0) == []
+	assert account.tasks(folder_number = 1)[0]["task_content"] == "bread"
+
+	assert account.post("remove_task", folder_number = 1, task_number = 0).status_code == 200
+	assert account.tasks(folder_number = 1) == []
+	assert account.post("remove_task", task_id = task["task_id"]).status_code == 404
+
+
+def test_tasks_of_other_users(neighbours):
+	alice, bob = neighbours
+	add_tasks(alice, ("secret", "", "1"))
+	task_id = alice.tasks(folder_number = 0)[0]["task_id"]
+	assert bob.post("remove_task", task_id = task_id).status_code == 404
+	assert bob.post("update_task", task_id = task_id, new_folder_number = 0,
+		new_content = "mine", new_deadline = "", new_priority = "1").status_code == 404
+	assert alice.tasks(folder_number = 0)[0]["task_content"] == "secret"
+
+
+def test_filters_sorting_and_pages(account):
+	add_tasks(account, ("a", "2030-03-01", "low"), ("b", "01.02.2030", "urgent"),
+		("c", "someday", "3"), ("d", "2030-01-01", "high"))
+
+	by_deadline = account.tasks(folder_number = 0, sort = "deadline")
+	assert [el["task_content"] for el in by_deadline] == ["d", "b", "a", "c"]
+	by_priority = account.tasks(folder_number = 0, sort = "-priority")
+	assert [el["task_content"] for el in by_priority] == ["b", "d", "c", "a"]
+	assert [el["task_content"] for el in account.tasks(folder_number = 0,
+		priority = "high")] == ["c", "d"]
+	assert [el["task_content"] for el in account.tasks(folder_number = 0,
+		deadline_from = "2030-01-15", deadline_to = "2030-02-28")] == ["b"]
+
+	pages, cursor = [], None
+	while True:
+		form = {"folder_number": 0, "sort": "deadline", "limit": 3}
+		if cursor:
+			form["cursor"] = cursor
+		page = account.post("get_tasks", **form).get_json()
+		pages.append([el["task_content"] for el in page["task_list"]])
+		cursor = page["next_cursor"]
+		if not cursor:
+			break
+	assert pages == [["d", "b", "a"], ["c"]]
+
+	# Cursors have to be signed by the server and hold a plain value
+	def page_after(data, signature):
+		return account.post("get_tasks", folder_number = 0, sort = "deadline",
+			cursor = f"{data}.{signature}" if signature else data).status_code
+
+	issued = Server.encode_cursor("2030-01-01", 1)
+	assert page_after(*issued.split(".")) == 200
+	for value in ("2030-01-02", {"a": 1}, [1, 2], None):
+		data = base64.urlsafe_b64encode(json.dumps([value, 1]).encode()).decode()
+		assert page_after(data, None) == page_after(data, issued.split(".")[1]) == 400
+		if value != "2030-01-02":
+			assert page_after(data, Server.sign_cursor(data)) == 400
+
+	assert account.post("get_tasks", folder_number = 0, sort = "name").status_code == 400
+	assert account.post("get_tasks", folder_number = 0, limit = 0).status_code == 400
+
+
+def test_upcoming_and_search(account):
+	account.post("create_folder", folder_name = "Work")
+	add_tasks(account, ("call the doctor", "2030-01-02", "1"))
+	add_tasks(account, ("write the report", "2030-01-01", "1"),
+		("review the code", "", "1"), folder_number = 1)
+
+	upcoming = account.post("upcoming_tasks", deadline_from = "2029-12-31") \
+		.get_json()["task_list"]
+	assert [el["task_content"] for el in upcoming] == ["write the report",
+		"call the doctor"]
+
+	found = account.post("search_tasks", query = "the code").get_json()["task_list"]
+	assert [el["task_content"] for el in found] == ["review the code"]
+	assert account.post("search_tasks", query = '"').get_json()["task_list"] == []
+	assert account.post("search_tasks", query = " ").status_code == 400
+
+
+def test_batch(account):
+	add_tasks(account, ("old", "", "1"), ("gone", "", "1"))
+	old, gone = account.tasks(folder_number = 0)
+	response = account.post("batch_tasks", operations = json.dumps([
+		{"op": "new", "folder_number": 0, "task_content": "new",
+			"task_deadline": "", "task_priority": "1"},
+		{"op": "update", "task_id": old["task_id"], "new_folder_number": 0,
+			"new_content": "updated", "new_deadline": "", "new_priority": "2"},
+		{"op": "remove", "task_id": gone["task_id"]},
+		{"op": "remove", "task_id": gone["task_id"] + 10 ** 6},
+		{"op": "new", "folder_number": 9, "task_content": "x",
+			"task_deadline": "", "task_priority": "1"},
+		{"op": "rename"}
+	]))
+	assert [el["status"] for el in response.get_json()["results"]] == \
+		[200, 200, 200, 404, 404, 400]
+	assert sorted(el["task_content"] for el in account.tasks(folder_number = 0)) == \
+		["new", "updated"]
+	assert account.post("batch_tasks", operations = "{}").status_code == 400
+
+
+def test_priorities():
+	assert [parse_priority(el) for el in ("3", " -2 ", "99999", "High", "²", "--5", "")] == \
+		[3, -2, 32767, 3, None, None, None]
+
+
+def test_unparsable_priority(account):
+	for priority in ("²", "--5"):
+		response = account.post("new_task", folder_number = 0, task_content = priority,
+			task_deadline = "", task_priority = priority)
+		assert response.status_code == 200
+	tasks = account.tasks(folder_number = 0)
+	assert [el["task_priority"] for el in tasks] == ["²", "--5"]
+	assert account.post("get_tasks", folder_number = 0, priority = "²").status_code == 400